@@ -0,0 +1,128 @@
+# admission.py
+
+import asyncio
+from collections import deque
+from contextlib import aclosing
+
+from config import Config
+
+class Overloaded(Exception):
+    """Raised when a stream can't be admitted; the /dl route answers 503 with Retry-After."""
+    def __init__(self, retry_after: int):
+        super().__init__(f"stream budget exhausted, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+class Ticket:
+    """One admitted stream's reservation. release() is idempotent."""
+    def __init__(self, controller, nbytes: int):
+        self.controller = controller
+        self.nbytes = nbytes
+
+    def release(self):
+        if self.controller is None: return
+        self.controller._release(self.nbytes)
+        self.controller = None
+
+    async def aclose(self):
+        # Async so Starlette runs it on the event loop rather than in a thread
+        self.release()
+
+class AdmissionController:
+    """
+    Caps the prefetch buffers held across all /dl streams. Each stream reserves its
+    worst-case buffer before the response starts; once the budget is spent, new
+    streams wait in a short FIFO queue and are shed when it is full or they time out.
+    """
+    def __init__(self, budget: int, max_queue: int, queue_timeout: float, retry_after: int):
+        self.budget = budget
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.reserved = 0
+        self.streams = 0
+        self._queue = deque()
+        self.admitted = 0
+        self.shed = 0
+
+    async def admit(self, nbytes: int) -> Ticket:
+        nbytes = min(nbytes, self.budget)  # a stream bigger than the budget still runs on its own
+        if not self._queue and self.reserved + nbytes <= self.budget:
+            return self._grant(nbytes)
+        if len(self._queue) >= self.max_queue:
+            self.shed += 1
+            raise Overloaded(self.retry_after)
+
+        entry = (asyncio.get_running_loop().create_future(), nbytes)
+        self._queue.append(entry)
+        try:
+            await asyncio.wait_for(entry[0], self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._leave(entry)
+            self.shed += 1
+            raise Overloaded(self.retry_after)
+        except asyncio.CancelledError:
+            self._leave(entry)
+            raise
+        return Ticket(self, nbytes)
+
+    def _leave(self, entry):
+        """Drops a waiter that gave up, so it neither blocks nor fills the queue."""
+        fut, nbytes = entry
+        if fut.done() and not fut.cancelled():
+            # Granted at the last moment; hand the reservation back
+            self._release(nbytes)
+            return
+        try: self._queue.remove(entry)
+        except ValueError: pass
+        # Whoever was behind it may fit now
+        self._admit_queued()
+
+    def _grant(self, nbytes):
+        self.reserved += nbytes
+        self.streams += 1
+        self.admitted += 1
+        return Ticket(self, nbytes)
+
+    def _release(self, nbytes):
+        self.reserved -= nbytes
+        self.streams -= 1
+        self._admit_queued()
+
+    def _admit_queued(self):
+        # Admit queued streams in order while they fit
+        while self._queue:
+            fut, want = self._queue[0]
+            if fut.done():
+                self._queue.popleft()
+                continue
+            if self.reserved + want > self.budget: break
+            self._queue.popleft()
+            self.reserved += want
+            self.streams += 1
+            self.admitted += 1
+            fut.set_result(None)
+
+    async def guard(self, body, ticket: Ticket):
+        """Passes `body` through and releases `ticket` when the stream ends."""
+        try:
+            async with aclosing(body):
+                async for chunk in body: yield chunk
+        finally:
+            ticket.release()
+
+    def stats(self):
+        return {
+            "streams": self.streams,
+            "reserved": self.reserved,
+            "budget": self.budget,
+            "queued": len(self._queue),
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
+
+admission = AdmissionController(
+    Config.STREAM_MEMORY_MB * 1024 * 1024,
+    Config.ADMISSION_QUEUE,
+    Config.ADMISSION_QUEUE_TIMEOUT,
+    Config.ADMISSION_RETRY_AFTER,
+)
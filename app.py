@@ -5,32 +5,140 @@ import traceback
 import uvicorn
 import re
 import logging
-import math
-import requests
 import base64
-import random
 import time
 
 from contextlib import asynccontextmanager
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from pyrogram import Client, filters, enums
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, ChatMemberUpdated, CallbackQuery
 from pyrogram.errors import FloodWait, UserNotParticipant
 from fastapi import FastAPI, Request, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse, RedirectResponse
+from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
-from pyrogram.file_id import FileId
-from pyrogram import raw
-from pyrogram.session import Session, Auth
+from starlette.background import BackgroundTask
 
 from config import Config
 from database import db
+from streamer import ByteStreamer, get_file_meta, cache_media, stream_stats, media_pool, buffer_bytes
+from cache import chunk_cache, meta_cache, disk_cache
+from scheduler import ClientScheduler
+from http_client import controller
+from delivery import ResultDelivery
+from broadcast import Broadcaster
+from signing import sign_link, verify_link, permanent_link
+from workers import worker_registry
+from admission import admission, Overloaded
+from responses import ClosingStreamingResponse
+from cluster import cluster
+from metrics import register_runtime, CONTROLLER_DISPATCH, observe_ttfb
+from ranges import parse_range_header, RangeNotSatisfiable, MultipartByteranges, make_etag, etag_matches
 
 # =====================================================================================
 # --- BACKGROUND TASKS (POLLER + SCANNER) ---
 # =====================================================================================
 
-# 1. Poll Controller for Finished Links (Fixes Infinite Loop & Log Channel 2)
+VIEWER_BASE = "https://v0-file-opener-video-player.vercel.app/view?value="
+
+# 1. Deliver Finished Links (pushed by the Controller, or polled as a fallback)
+async def deliver_result(msg):
+    # Parse Link
+    url_match = re.search(r"href=['\"](.*?)['\"]", msg['text'])
+    raw_url = url_match.group(1) if url_match else ""
+
+    if raw_url:
+        url_bytes = raw_url.encode('ascii')
+        base64_code = base64.b64encode(url_bytes).decode('ascii')
+        final_viewer_link = f"{VIEWER_BASE}{base64_code}"
+    else:
+        final_viewer_link = "https://google.com"
+
+    filename_match = re.search(r"📂 <b>File:</b> (.*)\n", msg['text'])
+    filename = filename_match.group(1) if filename_match else "File"
+
+    chat_id = int(msg['chat_id'])
+    message_id = int(msg.get('message_id', 0))
+
+    # 🟢 CASE 1: AUTO-UPLOAD CHANNELS (Edit Post)
+    if chat_id in Config.AUTO_UPLOAD_CHANNELS:
+        try:
+            print(f"🔄 Editing Channel Post {chat_id}:{message_id}")
+            original_msg = await bot.get_messages(chat_id, message_id)
+            existing_caption = original_msg.caption or ""
+
+            if "Here is 👉👉" not in existing_caption:
+                new_caption = (
+                    f"{existing_caption}\n\n"
+                    f"Here is 👉👉 <a href='{final_viewer_link}'>link</a> 👈👈"
+                )
+
+                buttons = InlineKeyboardMarkup([
+                    [InlineKeyboardButton("▶️ Open/Download Online", url=final_viewer_link)],
+                    [InlineKeyboardButton("🔗 Copy Link", url=final_viewer_link)]
+                ])
+
+                await bot.edit_message_caption(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    caption=new_caption,
+                    reply_markup=buttons,
+                    parse_mode=enums.ParseMode.HTML
+                )
+                print(f"✅ Auto-Edited Channel Post {message_id}")
+        except Exception as e:
+            print(f"❌ Failed to edit channel post: {e}")
+
+    # 🔵 CASE 2: PRIVATE USER (Send & Log)
+    else:
+        result_text = (
+            f"✅ <b>Permanent Link Ready!</b>\n\n"
+            f"📂 <b>File:</b> {filename}\n"
+            f"♾️ <b>Here is your permanent link of that file never expire high download and bandwidth.</b>\n\n"
+            f"👇 <b>Click below to Watch/Download</b>"
+        )
+        buttons = InlineKeyboardMarkup([
+            [InlineKeyboardButton("▶️ Open Online Player", url=final_viewer_link)]
+        ])
+
+        await bot.send_message(
+            chat_id=chat_id, 
+            text=result_text, 
+            reply_to_message_id=message_id, 
+            parse_mode=enums.ParseMode.HTML,
+            reply_markup=buttons
+        )
+
+        # 📝 LOG TO CHANNEL 2 (Explicit Debugging)
+        if Config.LOG_CHANNEL_2:
+            try:
+                user_link = f"<a href='tg://user?id={chat_id}'>{chat_id}</a>"
+                log_text = (
+                    f"<b>#PERMANENT_LINK_GENERATED</b>\n\n"
+                    f"👤 <b>User:</b> {user_link}\n"
+                    f"📂 <b>File:</b> {filename}\n"
+                    f"🔗 <b>Link:</b> {final_viewer_link}"
+                )
+                await bot.send_message(Config.LOG_CHANNEL_2, log_text, parse_mode=enums.ParseMode.HTML, disable_web_page_preview=True)
+                print(f"✅ Log sent to {Config.LOG_CHANNEL_2}")
+            except Exception as e:
+                print(f"❌ Failed to send Log Channel 2: {e}")
+
+async def ack_results(ids):
+    """Tells the Controller to DELETE delivered messages. Returns True on success."""
+    if not Config.HF_UPLOAD_WORKERS: return True
+    try:
+        ack_resp = await controller.post(f"{Config.HF_UPLOAD_WORKERS[0]}/donebotmessages", json={"message_ids": ids}, timeout=10)
+        if ack_resp.status_code == 200:
+            print(f"✅ Confirmed {len(ids)} msgs done.")
+            return True
+        print(f"⚠️ Controller ACK Failed: {ack_resp.status_code}")
+    except Exception as e:
+        print(f"❌ Controller ACK Connection Error: {e}")
+    return False
+
+result_delivery = ResultDelivery(deliver_result, ack_results, Config.DELIVERY_CONCURRENCY)
+
 async def poll_controller_queue():
     # Use the UPLOAD workers for this task (Controller logic)
     if not Config.HF_UPLOAD_WORKERS:
@@ -40,150 +148,79 @@ async def poll_controller_queue():
     CONTROLLER_URL = Config.HF_UPLOAD_WORKERS[0]
     print(f"🔄 Connected to Upload Controller: {CONTROLLER_URL}")
     print(f"📋 Monitoring Channels for Auto-Upload: {Config.AUTO_UPLOAD_CHANNELS}")
-    
-    VIEWER_BASE = "https://v0-file-opener-video-player.vercel.app/view?value="
 
+    interval = Config.POLL_MIN_INTERVAL
     while True:
+        messages = []
         try:
-            # Poll the Controller
-            response = await asyncio.to_thread(requests.get, f"{CONTROLLER_URL}/botmessages", timeout=10)
-
+            response = await controller.get(f"{CONTROLLER_URL}/botmessages", timeout=10)
             if response.status_code == 200:
-                data = response.json()
-                messages = data.get("messages", [])
-
-                if messages:
-                    sent_ids = [] # IDs to mark as done
-                    
-                    for msg in messages:
-                        try:
-                            # Parse Link
-                            url_match = re.search(r"href=['\"](.*?)['\"]", msg['text'])
-                            raw_url = url_match.group(1) if url_match else ""
-                            
-                            if raw_url:
-                                url_bytes = raw_url.encode('ascii')
-                                base64_code = base64.b64encode(url_bytes).decode('ascii')
-                                final_viewer_link = f"{VIEWER_BASE}{base64_code}"
-                            else:
-                                final_viewer_link = "https://google.com"
-
-                            filename_match = re.search(r"📂 <b>File:</b> (.*)\n", msg['text'])
-                            filename = filename_match.group(1) if filename_match else "File"
-                            
-                            chat_id = int(msg['chat_id'])
-                            message_id = int(msg.get('message_id', 0))
-
-                            # 🟢 CASE 1: AUTO-UPLOAD CHANNELS (Edit Post)
-                            if chat_id in Config.AUTO_UPLOAD_CHANNELS:
-                                try:
-                                    print(f"🔄 Editing Channel Post {chat_id}:{message_id}")
-                                    original_msg = await bot.get_messages(chat_id, message_id)
-                                    existing_caption = original_msg.caption or ""
-                                    
-                                    if "Here is 👉👉" not in existing_caption:
-                                        new_caption = (
-                                            f"{existing_caption}\n\n"
-                                            f"Here is 👉👉 <a href='{final_viewer_link}'>link</a> 👈👈"
-                                        )
-                                        
-                                        buttons = InlineKeyboardMarkup([
-                                            [InlineKeyboardButton("▶️ Open/Download Online", url=final_viewer_link)],
-                                            [InlineKeyboardButton("🔗 Copy Link", url=final_viewer_link)]
-                                        ])
-                                        
-                                        await bot.edit_message_caption(
-                                            chat_id=chat_id,
-                                            message_id=message_id,
-                                            caption=new_caption,
-                                            reply_markup=buttons,
-                                            parse_mode=enums.ParseMode.HTML
-                                        )
-                                        print(f"✅ Auto-Edited Channel Post {message_id}")
-                                except Exception as e:
-                                    print(f"❌ Failed to edit channel post: {e}")
-
-                            # 🔵 CASE 2: PRIVATE USER (Send & Log)
-                            else:
-                                result_text = (
-                                    f"✅ <b>Permanent Link Ready!</b>\n\n"
-                                    f"📂 <b>File:</b> {filename}\n"
-                                    f"♾️ <b>Here is your permanent link of that file never expire high download and bandwidth.</b>\n\n"
-                                    f"👇 <b>Click below to Watch/Download</b>"
-                                )
-                                buttons = InlineKeyboardMarkup([
-                                    [InlineKeyboardButton("▶️ Open Online Player", url=final_viewer_link)]
-                                ])
-                                
-                                await bot.send_message(
-                                    chat_id=chat_id, 
-                                    text=result_text, 
-                                    reply_to_message_id=message_id, 
-                                    parse_mode=enums.ParseMode.HTML,
-                                    reply_markup=buttons
-                                )
-
-                                # 📝 LOG TO CHANNEL 2 (Explicit Debugging)
-                                if Config.LOG_CHANNEL_2:
-                                    try:
-                                        user_link = f"<a href='tg://user?id={chat_id}'>{chat_id}</a>"
-                                        log_text = (
-                                            f"<b>#PERMANENT_LINK_GENERATED</b>\n\n"
-                                            f"👤 <b>User:</b> {user_link}\n"
-                                            f"📂 <b>File:</b> {filename}\n"
-                                            f"🔗 <b>Link:</b> {final_viewer_link}"
-                                        )
-                                        await bot.send_message(Config.LOG_CHANNEL_2, log_text, parse_mode=enums.ParseMode.HTML, disable_web_page_preview=True)
-                                        print(f"✅ Log sent to {Config.LOG_CHANNEL_2}")
-                                    except Exception as e:
-                                        print(f"❌ Failed to send Log Channel 2: {e}")
-
-                            # Add to list of completed messages
-                            sent_ids.append(msg['id'])
-                            await asyncio.sleep(0.5) 
-                        except Exception as e:
-                            print(f"❌ Processing Message Error: {e}")
-
-                    # 🔥 CRITICAL FIX: Tell Controller to DELETE these messages
-                    if sent_ids:
-                        try:
-                            ack_payload = {"message_ids": sent_ids}
-                            ack_resp = await asyncio.to_thread(requests.post, f"{CONTROLLER_URL}/donebotmessages", json=ack_payload, timeout=10)
-                            if ack_resp.status_code == 200:
-                                print(f"✅ Confirmed {len(sent_ids)} msgs done.")
-                            else:
-                                print(f"⚠️ Controller ACK Failed: {ack_resp.status_code}")
-                        except Exception as e:
-                            print(f"❌ Controller ACK Connection Error: {e}")
-        
+                messages = response.json().get("messages", [])
+                result_delivery.submit(messages)
         except Exception as e: 
             # print(f"Poller Loop Error: {e}")
             pass
-        
-        await asyncio.sleep(15)
+
+        # Adaptive fallback: poll fast while results flow, back off while idle
+        # or while the Controller is pushing results to the webhook itself.
+        if messages or result_delivery.pending: interval = Config.POLL_MIN_INTERVAL
+        else: interval = min(interval * 2, Config.POLL_MAX_INTERVAL)
+        if time.monotonic() - result_delivery.last_push < Config.POLL_MAX_INTERVAL:
+            interval = Config.POLL_MAX_INTERVAL
+        await asyncio.sleep(interval)
 
 # 2. Channel Scanner (Runs every 60s)
+# Channel posts the live handler already sent to the Controller but the scanner hasn't passed yet
+live_dispatched = set()
+# Newest post id seen per channel; every id up to it exists or was deleted, so gaps below it are skipped
+channel_tops = {}
+
+async def scan_channel(chat_id):
+    """Pages forward from the channel's stored watermark and dispatches every missed file."""
+    watermark = await db.get_watermark(chat_id)
+    if watermark is None: return  # The first live post sets the starting point
+
+    while True:
+        ids = list(range(watermark + 1, watermark + 1 + Config.SCAN_PAGE_SIZE))
+        messages = await bot.get_messages(chat_id, ids)
+        found = [m for m in messages if m and not m.empty]
+
+        for message in found:
+            media = message.document or message.video or message.audio
+            if media and (chat_id, message.id) not in live_dispatched:
+                # Only upload if NOT already processed
+                if "Here is 👉👉" not in (message.caption or ""):
+                    print(f"⚡ Found Missed File in {chat_id}: {message.id}")
+                    await auto_channel_handler(bot, message)
+                    await asyncio.sleep(5) 
+            live_dispatched.discard((chat_id, message.id))
+            watermark = message.id
+            await db.set_watermark(chat_id, watermark)
+
+        # Empty ids up to the newest known post are deleted messages: step over them
+        settled = min(ids[-1], channel_tops.get(chat_id, 0))
+        if settled > watermark:
+            watermark = settled
+            await db.set_watermark(chat_id, watermark)
+
+        # A partly empty page past the newest known post means we've reached the end
+        if watermark < ids[-1]: break
+
 async def scan_channels_periodically():
     if not Config.AUTO_UPLOAD_CHANNELS or not Config.HF_UPLOAD_WORKERS:
         print("⚠️ Scanner disabled (Missing Channels or Upload Controller)")
         return
 
     print(f"🕵️ Started Channel Scanner for: {Config.AUTO_UPLOAD_CHANNELS}")
+    sem = asyncio.Semaphore(Config.SCAN_CONCURRENCY)
+
+    async def scan_guarded(chat_id):
+        async with sem:
+            try: await scan_channel(chat_id)
+            except Exception as e: print(f"Scanner Error ({chat_id}): {e}")
+
     while True:
-        try:
-            for chat_id in Config.AUTO_UPLOAD_CHANNELS:
-                async for message in bot.get_chat_history(chat_id, limit=5):
-                    if message.media and not message.video_note and not message.sticker:
-                        caption = message.caption or ""
-                        # Only upload if NOT already processed
-                        if "Here is 👉👉" not in caption:
-                            print(f"⚡ Found Missed File in {chat_id}: {message.id}")
-                            # Call the handler directly
-                            await auto_channel_handler(bot, message)
-                            await asyncio.sleep(5) 
-        except Exception as e:
-            print(f"Scanner Error: {e}")
-        
+        await asyncio.gather(*[scan_guarded(chat_id) for chat_id in Config.AUTO_UPLOAD_CHANNELS])
         await asyncio.sleep(60)
 # =====================================================================================
 # --- SETUP & HELPERS ---
@@ -192,20 +229,29 @@ async def scan_channels_periodically():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await db.connect()
+    if not Config.LINK_SECRET and cluster.is_primary:
+        print("⚠️ LINK_SECRET is not set: signed links are keyed on BOT_TOKEN and stop working if it is rotated."
+              + (" Permanent links use raw message ids." if Config.ALLOW_RAW_DL_IDS else ""))
     try:
-        await bot.start()
-        me = await bot.get_me()
-        Config.BOT_USERNAME = me.username
-        print(f"✅ Bot Started: @{Config.BOT_USERNAME}")
-
-        multi_clients[0] = bot
-        work_loads[0] = 0
+        # In multi-process mode only web process 0 runs the updates bot and background jobs
+        if cluster.is_primary:
+            await bot.start()
+            me = await bot.get_me()
+            Config.BOT_USERNAME = me.username
+            print(f"✅ Bot Started: @{Config.BOT_USERNAME}")
+
+            multi_clients[0] = bot
+            work_loads[0] = 0
         await initialize_clients()
+        cluster.publish(clients=len(multi_clients))
+        if cluster.enabled: print(f"🧩 Web process {cluster.index} serving with {len(multi_clients)} clients")
         
-        asyncio.create_task(poll_controller_queue())
-        asyncio.create_task(scan_channels_periodically())
+        if cluster.is_primary:
+            asyncio.create_task(poll_controller_queue())
+            asyncio.create_task(scan_channels_periodically())
+        asyncio.create_task(worker_registry.run())
         
-        if Config.LOG_CHANNEL:
+        if Config.LOG_CHANNEL and cluster.is_primary:
             try: await bot.send_message(Config.LOG_CHANNEL, "🟢 **Bot Online & Scanning**")
             except: pass
 
@@ -214,6 +260,8 @@ async def lifespan(app: FastAPI):
     
     yield
     if bot.is_initialized: await bot.stop()
+    await controller.close()
+    await cluster.close()
     await db.disconnect()
 
 app = FastAPI(lifespan=lifespan)
@@ -244,6 +292,8 @@ bot = Client(
 multi_clients = {}
 work_loads = {}
 class_cache = {}
+scheduler = ClientScheduler(multi_clients, work_loads)
+register_runtime(work_loads, stream_stats)
 
 class TokenParser:
     @staticmethod
@@ -258,8 +308,11 @@ async def start_client(client_id, bot_token):
     except Exception: pass
 
 async def initialize_clients():
-    tokens = TokenParser.parse_from_env()
+    tokens = {i: t for i, t in TokenParser.parse_from_env().items() if cluster.owns(i)}
     if tokens: await asyncio.gather(*[start_client(i, t) for i, t in tokens.items()])
+    # Pre-build media sessions so the first stream on a foreign DC doesn't pay for auth
+    if Config.MEDIA_DC_IDS:
+        await asyncio.gather(*[media_pool.warm(c, Config.MEDIA_DC_IDS) for c in multi_clients.values()])
 
 def get_readable_file_size(size_in_bytes):
     if not size_in_bytes: return '0B'
@@ -293,7 +346,15 @@ async def debug_command(client, message):
         f"1️⃣ <b>Upload Workers (Controller):</b>\n<code>{Config.HF_UPLOAD_WORKERS}</code>\n\n"
         f"2️⃣ <b>Streaming Workers (Download):</b>\n<code>{Config.HF_STREAMING_URLS}</code>\n\n"
         f"3️⃣ <b>Auto Channels:</b>\n<code>{Config.AUTO_UPLOAD_CHANNELS}</code>\n\n"
-        f"4️⃣ <b>Log Channel 2:</b>\n<code>{Config.LOG_CHANNEL_2}</code>"
+        f"4️⃣ <b>Log Channel 2:</b>\n<code>{Config.LOG_CHANNEL_2}</code>\n\n"
+        f"5️⃣ <b>Chunk Cache:</b>\n<code>{chunk_cache.stats()}</code>\n"
+        f"💾 <b>Disk Tier:</b> <code>{disk_cache.stats() if disk_cache else 'off'}</code>\n"
+        f"🚦 <b>Admission:</b> <code>{admission.stats()}</code>\n\n"
+        f"6️⃣ <b>Meta Cache:</b>\n<code>{meta_cache.stats()}</code>\n\n"
+        f"7️⃣ <b>Stream Stats:</b>\n<code>{stream_stats}</code>\n\n"
+        f"8️⃣ <b>Clients:</b>\n<code>{scheduler.stats()}</code>\n\n"
+        f"9️⃣ <b>Streaming Worker Health:</b>\n<code>{worker_registry.stats()}</code>"
+        + (f"\n\n🧩 <b>Web Processes:</b>\n<code>{cluster.stats()}</code>" if cluster.enabled else "")
     )
     await message.reply(debug_text, parse_mode=enums.ParseMode.HTML)
 
@@ -302,15 +363,16 @@ async def broadcast_handler(client, message):
     if len(message.command) < 2: return await message.reply("Usage: `/all Hello`")
     text = message.text.split(None, 1)[1]
     status_msg = await message.reply("⏳ Broadcasting...")
-    users = await db.col_users.find({}).to_list(length=None) 
-    done, error = 0, 0
-    for user in users:
-        try:
-            await bot.send_message(user['_id'], text)
-            done += 1
-            await asyncio.sleep(0.1)
-        except: error += 1
-    await status_msg.edit(f"✅ **Done**\nSuccess: {done}\nFailed: {error}")
+    state = await db.create_broadcast(text)
+    state.setdefault('_id', None)
+    await Broadcaster(bot, status_msg, state).run()
+
+@bot.on_message(filters.command("resumeall") & filters.user(Config.ADMINS))
+async def resume_broadcast_handler(client, message):
+    state = await db.get_unfinished_broadcast()
+    if not state: return await message.reply("✅ No interrupted broadcast to resume.")
+    status_msg = await message.reply(f"⏳ Resuming broadcast after user `{state.get('last_user_id')}`...")
+    await Broadcaster(bot, status_msg, state).run()
 
 @bot.on_message(filters.command(["ban", "unban"]) & filters.user(Config.ADMINS))
 async def admin_ban_handler(client, message):
@@ -342,6 +404,8 @@ async def stats_command(client, message):
 # 🆕 AUTO-UPLOAD LISTENER
 @bot.on_message(filters.chat(Config.AUTO_UPLOAD_CHANNELS) & (filters.document | filters.video | filters.audio))
 async def auto_channel_handler(client, message):
+    channel_tops[message.chat.id] = max(channel_tops.get(message.chat.id, 0), message.id)
+
     # Only process if configured
     if not Config.HF_UPLOAD_WORKERS: 
         print("❌ Auto-Upload Ignored: No Upload Controller.")
@@ -353,6 +417,10 @@ async def auto_channel_handler(client, message):
 
     CONTROLLER_URL = Config.HF_UPLOAD_WORKERS[0]
     media = message.document or message.video or message.audio
+
+    # Give the scanner a starting point on first use, and tell it this post is being handled
+    await db.init_watermark(message.chat.id, message.id - 1)
+    live_dispatched.add((message.chat.id, message.id))
     
     print(f"⚡ Auto-Upload Triggered for: {message.chat.id} -> {media.file_name}")
     
@@ -360,14 +428,17 @@ async def auto_channel_handler(client, message):
         # Copy to storage to get a permanent file ID for the stream link
         stored = await message.copy(Config.STORAGE_CHANNEL)
     except Exception as e:
+        # Nothing was dispatched: leave the post for the scanner to pick up again
+        live_dispatched.discard((message.chat.id, message.id))
         print(f"❌ Storage Copy Failed (Bot not admin in Storage?): {e}")
         return 
     
     safe_name = "".join(c for c in (media.file_name or "vid.mp4") if c.isalnum() or c in ('.', '_', '-')).rstrip()
     
     # NOTE: For auto-upload, we generate a generic stream link. 
-    # The Controller will later enhance it or you can change this logic to use stateless links too.
-    stream_link = f"{Config.BASE_URL}/dl/{stored.id}/{safe_name}"
+    # It is a permanent link, so it never expires even when LINK_TTL is set.
+    token = permanent_link(stored.id, media.file_size, media.mime_type, media.file_name)
+    stream_link = f"{Config.BASE_URL}/dl/{token}/{safe_name}"
     
     payload = {
         "stream_link": stream_link,
@@ -380,16 +451,18 @@ async def auto_channel_handler(client, message):
     asyncio.create_task(dispatch_background(CONTROLLER_URL, payload))
 
 async def dispatch_background(url, payload):
-    # Retry 3 times
-    for _ in range(3):
-        try:
-            res = requests.post(f"{url}/upload", json=payload, timeout=5)
-            if res.status_code == 200:
-                print(f"✅ Auto-Upload Dispatched for {payload['file_name']}")
-                return 
-        except Exception as e: 
-            print(f"❌ Dispatch Fail: {e}")
-            await asyncio.sleep(2)
+    # Retries (3x, jittered backoff) are handled by the shared controller client
+    try:
+        res = await controller.post(f"{url}/upload", json=payload, timeout=5)
+        if res.status_code == 200:
+            CONTROLLER_DISPATCH.labels(outcome="accepted").inc()
+            print(f"✅ Auto-Upload Dispatched for {payload['file_name']}")
+        else:
+            CONTROLLER_DISPATCH.labels(outcome="rejected").inc()
+            print(f"❌ Dispatch Fail: HTTP {res.status_code}")
+    except Exception as e: 
+        CONTROLLER_DISPATCH.labels(outcome="error").inc()
+        print(f"❌ Dispatch Fail: {e}")
     # =====================================================================================
 # --- BOT HANDLERS (USER SIDE) ---
 # =====================================================================================
@@ -425,10 +498,12 @@ async def handle_file_upload(client: Client, message: Message):
     try:
         # 2. Copy to Storage Channel
         sent_message = await message.copy(chat_id=Config.STORAGE_CHANNEL)
-        unique_id = secrets.token_urlsafe(8)
-        await db.save_link(unique_id, sent_message.id)
         
+        # The signed links below carry what /show needs, so nothing is saved per link
         media = message.document or message.video or message.audio
+        stored_media = sent_message.document or sent_message.video or sent_message.audio or media
+        cache_media(client, sent_message.id, stored_media)
+        
         file_name = media.file_name or "Unknown_File"
         file_size = get_readable_file_size(media.file_size)
         
@@ -436,24 +511,28 @@ async def handle_file_upload(client: Client, message: Message):
         # 🚀 NEW LOGIC: Use HF_STREAMING_URLS (Bandwidth Offload)
         # ==================================================================
         
-        # A. Select a STREAMING Worker (Not an Upload Worker)
-        if Config.HF_STREAMING_URLS:
-            worker_url = random.choice(Config.HF_STREAMING_URLS)
-        else:
+        # A. Select a STREAMING Worker (Not an Upload Worker): healthy, and the same one for the same file
+        worker_url = worker_registry.pick(sent_message.id)
+        if not worker_url:
             print("⚠️ No Streaming Worker! Using Render URL.")
             worker_url = Config.BASE_URL 
             
         # B. Create the Direct Stream Link
         # Format: https://hf-streaming-space.hf.space/stream/{message_id}/{filename}
+        # The Render fallback gets a signed token instead of the raw storage message id.
         safe_name = file_name.replace(' ', '_')
-        hf_direct_link = f"{worker_url}/stream/{sent_message.id}/{safe_name}"
+        token = sign_link(sent_message.id, media.file_size, media.mime_type, file_name)
+        if worker_url != Config.BASE_URL:
+            hf_direct_link = f"{worker_url}/stream/{sent_message.id}/{safe_name}"
+        else:
+            hf_direct_link = f"{worker_url}/dl/{token}/{safe_name}"
         
         # C. Encode to Base64 for Vercel
         hf_base64 = base64.b64encode(hf_direct_link.encode('utf-8')).decode('utf-8')
         
         # D. Final Links
         opener_link = f"https://v0-file-opener-video-player.vercel.app/view?value={hf_base64}"
-        stream_link = f"{Config.BASE_URL}/show/{unique_id}" 
+        stream_link = f"{Config.BASE_URL}/show/{token}" 
         
         # ==================================================================
 
@@ -467,7 +546,8 @@ async def handle_file_upload(client: Client, message: Message):
             f"📦 <b>FILE SIZE :-</b> {file_size}\n\n"
             f"<b><u>Tap To Copy Link</u></b> 👇\n\n"
             f"🖥 <b>Stream :</b> <code>{opener_link}</code>\n"
-            f"📥 <b>Download :</b> <code>{hf_direct_link}</code>\n\n"
+            f"📥 <b>Download :</b> <code>{hf_direct_link}</code>\n"
+            f"🌐 <b>Page :</b> <code>{stream_link}</code>\n\n"
             f"🚸 <b>NOTE : BANDWIDTH MOVED TO EXTERNAL WORKER 🚀</b>"
         )
         buttons = InlineKeyboardMarkup([
@@ -508,30 +588,27 @@ async def ia_upload_handler(client, callback_query):
         media = stored_msg.document or stored_msg.video or stored_msg.audio
         
         safe_name = "".join(c for c in (media.file_name or "vid.mp4") if c.isalnum() or c in ('.', '_', '-')).rstrip()
-        stream_link = f"{Config.BASE_URL}/dl/{msg_id}/{safe_name}"
+        token = permanent_link(msg_id, media.file_size, media.mime_type, media.file_name)
+        stream_link = f"{Config.BASE_URL}/dl/{token}/{safe_name}"
         
         payload = { "stream_link": stream_link, "file_name": media.file_name, "chat_id": user_msg.chat.id, "message_id": user_msg.id }
         
-        success = False
-        last_error = ""
-        for attempt in range(3):
-            try:
-                resp = await asyncio.to_thread(requests.post, f"{CONTROLLER_URL}/upload", json=payload, timeout=60)
-                if resp.status_code == 200:
-                    try:
-                        done_markup = InlineKeyboardMarkup([[old[0][0], old[0][1]], [InlineKeyboardButton("✅ Task Accepted!", callback_data="ignore")], old[2]])
-                        await callback_query.edit_message_reply_markup(reply_markup=done_markup)
-                    except: pass
-                    
-                    await callback_query.answer("✅ Task Accepted! Link coming soon...", show_alert=True)
-                    success = True
-                    break
-                else: last_error = f"HTTP {resp.status_code}"
-            except Exception as e:
-                last_error = str(e)
-                if attempt < 2: await asyncio.sleep(2)
+        # Single attempt: the user is waiting on this callback
+        try: resp = await controller.post(f"{CONTROLLER_URL}/upload", json=payload, timeout=60, retries=1)
+        except Exception as e:
+            CONTROLLER_DISPATCH.labels(outcome="error").inc()
+            raise Exception(f"Controller Failed: {e}")
+        if resp.status_code != 200:
+            CONTROLLER_DISPATCH.labels(outcome="rejected").inc()
+            raise Exception(f"Controller Failed: HTTP {resp.status_code}")
+        CONTROLLER_DISPATCH.labels(outcome="accepted").inc()
+        
+        try:
+            done_markup = InlineKeyboardMarkup([[old[0][0], old[0][1]], [InlineKeyboardButton("✅ Task Accepted!", callback_data="ignore")], old[2]])
+            await callback_query.edit_message_reply_markup(reply_markup=done_markup)
+        except: pass
         
-        if not success: raise Exception(f"Controller Failed: {last_error}")
+        await callback_query.answer("✅ Task Accepted! Link coming soon...", show_alert=True)
 
     except Exception as e:
         print(f"Handoff Error: {e}")
@@ -551,100 +628,175 @@ async def ignore_callback(client, callback_query): await callback_query.answer("
 @app.get("/")
 async def health(): return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics(): return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.post("/controller/results")
+async def controller_results(request: Request):
+    """Webhook the Controller POSTs finished results to (same shape as /botmessages)."""
+    # Delivery runs next to the bot, on web process 0
+    if not cluster.is_primary: return await cluster.proxy(request, 0)
+    secret = request.headers.get("X-Controller-Secret", "")
+    if not Config.CONTROLLER_SECRET or not secrets.compare_digest(secret, Config.CONTROLLER_SECRET):
+        raise HTTPException(401, "Unauthorized")
+    data = await request.json()
+    messages = data.get("messages", [data]) if isinstance(data, dict) else data
+    accepted = result_delivery.submit(messages)
+    result_delivery.last_push = time.monotonic()
+    return JSONResponse({"accepted": accepted}, status_code=202)
+
+def get_streamer(client):
+    streamer = class_cache.get(client) or ByteStreamer(client, work_loads, scheduler)
+    class_cache[client] = streamer
+    return streamer
+
+def dl_cache_control(signed):
+    """DL_CACHE_CONTROL, with max-age capped at the remaining lifetime of an expiring token."""
+    if not signed or not signed["expires"]: return Config.DL_CACHE_CONTROL
+    remaining = max(0, int(signed["expires"] - time.time()))
+    directives, capped = [], False
+    for d in (d.strip() for d in Config.DL_CACHE_CONTROL.split(",")):
+        name, _, value = d.partition("=")
+        if name.lower() in ("max-age", "s-maxage"):
+            capped = True
+            d = f"{name}={min(int(value) if value.isdigit() else 0, remaining)}"
+        elif name.lower() == "immutable": continue
+        directives.append(d)
+    if not capped: directives.append(f"max-age={remaining}")
+    return ", ".join(d for d in directives if d)
+
+async def warm_up_link(msg_id):
+    """Head/tail prefetch for a /show page whose player will stream from this instance."""
+    idx = scheduler.pick()
+    if idx is None: return
+    client = multi_clients[idx]
+    try: media = await get_file_meta(client, msg_id)
+    except Exception: return
+    await get_streamer(client).warm_up(idx, media)
+
 @app.get("/show/{unique_id}", response_class=HTMLResponse)
 async def show_page(request: Request, unique_id: str):
-    sid = await db.get_link(unique_id)
-    if not sid: raise HTTPException(404, "Link Expired")
+    # Signed links carry their own metadata; anything else is a saved link id
+    signed = verify_link(unique_id)
+    if signed: link = {"message_id": signed["msg_id"], "file_name": signed["file_name"], "file_size": signed["file_size"], "mime_type": signed["mime_type"]}
+    elif "." in unique_id: raise HTTPException(404, "Link Expired")
+    else: link = await db.get_link_info(unique_id)
+    if not link: raise HTTPException(404, "Link Expired")
+    sid = link['message_id']
     try:
-        msg = await multi_clients[0].get_messages(Config.STORAGE_CHANNEL, sid)
-        media = msg.document or msg.video or msg.audio
-        fname = media.file_name or "File"
+        if link.get('file_size') is None:
+            # Link saved before metadata was stored: look it up once and backfill
+            main_bot = multi_clients.get(0) or next(iter(multi_clients.values()))
+            media = await get_file_meta(main_bot, sid)
+            fields = {"file_name": media.file_name, "file_size": media.file_size, "mime_type": media.mime_type, "file_id": media.file_ids[main_bot].encode(), "file_unique_id": media.file_unique_id}
+            link.update(fields)
+            await db.update_link_media(unique_id, **fields)
+        fname = link.get('file_name') or "File"
+        mime_type = link.get('mime_type')
         sname = "".join(c for c in fname if c.isalnum() or c in (' ', '.', '_', '-')).rstrip()
-        file_size = get_readable_file_size(media.file_size)
-        dlink = f"{Config.BASE_URL}/dl/{sid}/{sname}"
-        context = { "request": request, "file_name": mask_filename(fname), "file_size": file_size, "is_media": (media.mime_type or "").startswith(("video", "audio")), "direct_dl_link": dlink, "mx_player_link": f"intent:{dlink}#Intent;action=android.intent.action.VIEW;type={media.mime_type};end", "vlc_player_link": f"vlc://{dlink}" }
+        file_size = get_readable_file_size(link['file_size'])
+        dlink = f"{Config.BASE_URL}/dl/{unique_id if signed else sid}/{sname}"
+        if Config.STREAM_WARMUP and (mime_type or "").startswith(("video", "audio")) and not (Config.HF_STREAMING_URLS and worker_registry.pick(sid)):
+            asyncio.create_task(warm_up_link(sid))
+        context = { "request": request, "file_name": mask_filename(fname), "file_size": file_size, "is_media": (mime_type or "").startswith(("video", "audio")), "direct_dl_link": dlink, "mx_player_link": f"intent:{dlink}#Intent;action=android.intent.action.VIEW;type={mime_type};end", "vlc_player_link": f"vlc://{dlink}" }
         return templates.TemplateResponse("show.html", context)
     except: raise HTTPException(404, "File Not Found")
 
-class ByteStreamer:
-    def __init__(self, client: Client): self.client = client
-    async def yield_file(self, file_id, index, offset, first_part_cut, last_part_cut, part_count, chunk_size):
-        client = self.client
-        work_loads[index] += 1
-        ms = client.media_sessions.get(file_id.dc_id)
-        if not ms:
-            if file_id.dc_id != await client.storage.dc_id():
-                auth_key = await Auth(client, file_id.dc_id, await client.storage.test_mode()).create()
-                ms = Session(client, file_id.dc_id, auth_key, await client.storage.test_mode(), is_media=True)
-                await ms.start()
-                exp = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=file_id.dc_id))
-                await ms.invoke(raw.functions.auth.ImportAuthorization(id=exp.id, bytes=exp.bytes))
-            else: ms = client.session
-            client.media_sessions[file_id.dc_id] = ms
-        
-        loc = raw.types.InputDocumentFileLocation(id=file_id.media_id, access_hash=file_id.access_hash, file_reference=file_id.file_reference, thumb_size=file_id.thumbnail_size)
-        curr = 1
-        try:
-            while curr <= part_count:
-                r = await ms.invoke(raw.functions.upload.GetFile(location=loc, offset=offset, limit=chunk_size), retries=0)
-                if isinstance(r, raw.types.upload.File):
-                    chunk = r.bytes
-                    if not chunk: break
-                    if part_count == 1: yield chunk[first_part_cut:last_part_cut]
-                    elif curr == 1: yield chunk[first_part_cut:]
-                    elif curr == part_count: yield chunk[:last_part_cut]
-                    else: yield chunk
-                    curr += 1
-                    offset += chunk_size
-                else: break
-        finally: work_loads[index] -= 1
-
-@app.get("/dl/{msg_id}/{file_name}")
-async def stream_handler(request: Request, msg_id: int, file_name: str):
+@app.api_route("/dl/{msg_id}/{file_name}", methods=["GET", "HEAD"])
+async def stream_handler(request: Request, msg_id: str, file_name: str):
     """
     Standard Streaming Route.
     1. Tries to redirect to HF_STREAMING_URLS if available (Saves Bandwidth).
     2. Falls back to Render streaming if no HF worker is set.
+    HEAD is answered from cached metadata; multi-range requests get multipart/byteranges.
+    `msg_id` is a signed link token, or a raw storage message id if ALLOW_RAW_DL_IDS is on.
     """
+    started = time.monotonic()
+    signed = verify_link(msg_id)
+    if signed: msg_id = signed["msg_id"]
+    elif msg_id.isdigit() and Config.ALLOW_RAW_DL_IDS: msg_id = int(msg_id)
+    else: raise HTTPException(404, "Invalid link")
+
     # 🚀 OFF-LOAD BANDWIDTH TO HUGGING FACE
-    if Config.HF_STREAMING_URLS:
-        worker_url = random.choice(Config.HF_STREAMING_URLS)
+    worker_url = worker_registry.pick(msg_id) if Config.HF_STREAMING_URLS else None
+    if worker_url:
         final_url = f"{worker_url}/stream/{msg_id}/{file_name}"
         return RedirectResponse(url=final_url, status_code=307)
     
-    # ⚠️ FALLBACK: USE RENDER BANDWIDTH (IF NO WORKER CONFIGURED)
+    # 🧩 MULTI-PROCESS: hand the stream to the file's owner process (or a less loaded one)
+    target = cluster.route(request, msg_id)
+    if target is not None:
+        try: return await cluster.proxy(request, target)
+        except Exception as e: print(f"⚠️ Hand-off to web process {target} failed: {e}")
+    
+    # ⚠️ FALLBACK: USE RENDER BANDWIDTH (IF NO WORKER CONFIGURED OR ALL ARE DOWN)
     try:
-        idx = min(work_loads, key=work_loads.get, default=0)
+        cached = meta_cache.get(msg_id)
+        dc_id = next(iter(cached.file_ids.values())).dc_id if cached and cached.file_ids else None
+        idx = scheduler.pick(dc_id)
         client = multi_clients[idx]
-        streamer = class_cache.get(client) or ByteStreamer(client)
-        class_cache[client] = streamer
+        streamer = get_streamer(client)
         
-        msg = await client.get_messages(Config.STORAGE_CHANNEL, msg_id)
-        media = msg.document or msg.video or msg.audio
-        if not media: raise FileNotFoundError
-        fid = FileId.decode(media.file_id)
+        for attempt in range(2):
+            try:
+                media = await get_file_meta(client, msg_id)
+                break
+            except FloodWait as e:
+                scheduler.record_error(idx, e)
+                # One retry on the client pick() now prefers; it skips flood-limited ones while any are free
+                retry = scheduler.pick(dc_id)
+                if attempt or retry == idx:
+                    return Response("Telegram rate limit, try again shortly", status_code=503, headers={"Retry-After": str(max(1, int(e.value or 0)))})
+                idx, client = retry, multi_clients[retry]
+                streamer = get_streamer(client)
+        fid = media.file_ids[client]
         file_size = media.file_size
+        mime_type = media.mime_type or "application/octet-stream"
         
-        range_header = request.headers.get("Range", 0)
-        from_bytes, until_bytes = 0, file_size - 1
-        if range_header:
-            s = range_header.replace("bytes=", "").split("-")
-            from_bytes = int(s[0])
-            if s[1]: until_bytes = int(s[1])
-            
-        req_len = until_bytes - from_bytes + 1
-        chunk = 1048576
-        offset = (from_bytes // chunk) * chunk
-        first_cut = from_bytes - offset
-        last_cut = (until_bytes % chunk) + 1
-        parts = math.ceil(req_len / chunk)
+        etag = make_etag(media.file_unique_id, file_size)
+        headers = {"Content-Type": mime_type, "Content-Disposition": f'inline; filename="{media.file_name}"', "Accept-Ranges": "bytes", "ETag": etag, "Cache-Control": dl_cache_control(signed)}
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": headers["Cache-Control"]})
+        
+        range_header = request.headers.get("Range")
+        # If-Range: only honour the range when the client's copy is still the current one
+        if_range = request.headers.get("If-Range")
+        if if_range and not etag_matches(if_range, etag, weak=False): range_header = None
+        try: ranges = parse_range_header(range_header, file_size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{file_size}", "Accept-Ranges": "bytes"})
+        
+        if ranges is None or len(ranges) == 1:
+            from_bytes, until_bytes = ranges[0] if ranges else (0, file_size - 1)
+            headers["Content-Length"] = str(until_bytes - from_bytes + 1)
+            if ranges: headers["Content-Range"] = f"bytes {from_bytes}-{until_bytes}/{file_size}"
+            status_code = 206 if ranges else 200
+            if request.method == "HEAD": return Response(status_code=status_code, headers=headers)
+            body = streamer.yield_range(fid, idx, from_bytes, until_bytes, msg_id=msg_id)
+            reserve = buffer_bytes(from_bytes, until_bytes)
+        else:
+            multipart = MultipartByteranges(ranges, file_size, mime_type)
+            headers["Content-Type"] = multipart.content_type
+            headers["Content-Length"] = str(multipart.content_length())
+            status_code = 206
+            if request.method == "HEAD": return Response(status_code=status_code, headers=headers)
+            body = multipart.stream(lambda start, end: streamer.yield_range(fid, idx, start, end, msg_id=msg_id))
+            reserve = max(buffer_bytes(start, end) for start, end in ranges)
         
-        body = streamer.yield_file(fid, idx, offset, first_cut, last_cut, parts, chunk)
-        headers = {"Content-Type": media.mime_type or "application/octet-stream", "Content-Disposition": f'inline; filename="{media.file_name}"', "Content-Length": str(req_len), "Accept-Ranges": "bytes"}
-        if range_header: headers["Content-Range"] = f"bytes {from_bytes}-{until_bytes}/{file_size}"
-        return StreamingResponse(body, status_code=206 if range_header else 200, headers=headers)
+        # 🚦 Reserve prefetch memory before committing to a 200/206
+        try: ticket = await admission.admit(reserve)
+        except Overloaded as e:
+            return Response("Server busy, try again shortly", status_code=503, headers={"Retry-After": str(e.retry_after)})
+        # Only a GET that is actually streaming warms the file; HEAD/304/416/503 fetch nothing
+        if Config.STREAM_WARMUP and not media.warmed: asyncio.create_task(streamer.warm_up(idx, media))
+        # The guard releases when the body ends; the background task covers bodies that never start
+        body = cluster.track(admission.guard(body, ticket))
+        return ClosingStreamingResponse(observe_ttfb(body, started), status_code=status_code, headers=headers, background=BackgroundTask(ticket.aclose))
     except: raise HTTPException(404)
 
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=int(os.environ.get("PORT", 8000)))
+    port = int(os.environ.get("PORT", 8000))
+    if cluster.enabled: cluster.run(app, port)
+    # Pass the object: "app:app" would import this file a second time as another module
+    else: uvicorn.run(app, host="0.0.0.0", port=port)
             
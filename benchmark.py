@@ -0,0 +1,178 @@
+# benchmark.py
+# Offline streaming benchmark. Replaces the Telegram clients with a local fake
+# MTProto file server and drives the real /dl route over HTTP, so ByteStreamer
+# changes can be compared on a plain Linux box without touching Telegram.
+#
+#   python benchmark.py --files 4 --size-mb 64 --concurrency 16 --latency-ms 80 --bandwidth-mbps 40
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+
+# Keep Config quiet and force the local (Render fallback) streaming path
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "benchmark")
+os.environ.setdefault("BOT_TOKEN", "1:benchmark")
+os.environ["HF_STREAMING_URLS"] = ""
+os.environ["HF_STREAMING_WORKER"] = ""
+
+import httpx
+import uvicorn
+from pyrogram import raw
+from pyrogram.file_id import FileId, FileType
+
+import app as server
+from config import Config
+from cache import chunk_cache
+
+STORAGE_DC = 2
+
+class FakeMediaSession:
+    """Answers upload.GetFile from synthetic files with a fixed latency and a shared bandwidth cap."""
+    def __init__(self, files: dict, latency: float, bandwidth: float):
+        self.dc_id = STORAGE_DC
+        self.files = files
+        self.latency = latency
+        self.bandwidth = bandwidth  # bytes per second for this session
+        self._link = asyncio.Lock()
+        self.requests = 0
+        self.bytes = 0
+
+    async def invoke(self, query, retries=0, **kwargs):
+        if not isinstance(query, raw.functions.upload.GetFile):
+            raise NotImplementedError(type(query).__name__)
+        data = self.files[query.location.id]
+        chunk = data[query.offset:query.offset + query.limit]
+        self.requests += 1
+        self.bytes += len(chunk)
+        await asyncio.sleep(self.latency)
+        # Replies share the session's bandwidth, like parts on one MTProto connection
+        async with self._link:
+            await asyncio.sleep(len(chunk) / self.bandwidth)
+        return raw.types.upload.File(type=raw.types.storage.FilePartial(), mtime=0, bytes=chunk)
+
+class FakeStorage:
+    async def dc_id(self): return STORAGE_DC
+    async def test_mode(self): return False
+
+class FakeDocument:
+    def __init__(self, media_id, size):
+        self.file_id = FileId(file_type=FileType.DOCUMENT, dc_id=STORAGE_DC, media_id=media_id, access_hash=media_id, file_reference=b"").encode()
+        self.file_unique_id = f"bench{media_id}"
+        self.file_size = size
+        self.file_name = f"bench_{media_id}.mp4"
+        self.mime_type = "video/mp4"
+
+class FakeMessage:
+    def __init__(self, document):
+        self.empty = document is None
+        self.document = document
+        self.video = None
+        self.audio = None
+
+class FakeClient:
+    """Stands in for a pyrogram Client: storage-channel lookups plus one media session."""
+    def __init__(self, name, files, latency, bandwidth, lookup_latency):
+        self.name = name
+        self.files = files
+        self.lookup_latency = lookup_latency
+        self.session = FakeMediaSession(files, latency, bandwidth)
+        self.media_sessions = {}
+        self.storage = FakeStorage()
+
+    async def get_messages(self, chat_id, msg_id):
+        await asyncio.sleep(self.lookup_latency)
+        data = self.files.get(msg_id)
+        return FakeMessage(FakeDocument(msg_id, len(data)) if data is not None else None)
+
+def percentile(values, pct):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+async def download(http, url, headers):
+    started = time.monotonic()
+    ttfb = None
+    size = 0
+    async with http.stream("GET", url, headers=headers) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.aiter_raw():
+            if ttfb is None: ttfb = time.monotonic() - started
+            size += len(chunk)
+    return ttfb or 0.0, size, time.monotonic() - started
+
+async def run(args):
+    files = {i + 1: os.urandom(int(args.size_mb * 1024 * 1024)) for i in range(args.files)}
+    for i in range(args.clients):
+        server.multi_clients[i] = FakeClient(str(i), files, args.latency_ms / 1000, args.bandwidth_mbps * 1024 * 1024 / 8, args.lookup_ms / 1000)
+        server.work_loads[i] = 0
+    Config.HF_STREAMING_URLS = []
+    if args.no_cache: chunk_cache.max_bytes = 0
+
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=args.port, lifespan="off", log_level="warning")
+    web = uvicorn.Server(config)
+    web_task = asyncio.create_task(web.serve())
+    while not web.started: await asyncio.sleep(0.05)
+
+    # Mix full downloads and short range probes across the synthetic files
+    jobs = []
+    for n in range(args.requests):
+        msg_id = n % args.files + 1
+        size = len(files[msg_id])
+        headers = {}
+        if args.range_every and n % args.range_every == 0:
+            start = (n * 7919 * 4099) % max(1, size - args.range_kb * 1024)
+            headers["Range"] = f"bytes={start}-{start + args.range_kb * 1024 - 1}"
+        jobs.append((f"http://127.0.0.1:{args.port}/dl/{msg_id}/bench.mp4", headers))
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sem = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(timeout=None, limits=limits) as http:
+        async def one(job):
+            async with sem: return await download(http, *job)
+        started = time.monotonic()
+        results = await asyncio.gather(*[one(job) for job in jobs])
+        elapsed = time.monotonic() - started
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    web.should_exit = True
+    await web_task
+
+    ttfbs = [r[0] * 1000 for r in results]
+    total = sum(r[1] for r in results)
+    upstream = sum(c.session.bytes for c in server.multi_clients.values())
+    calls = sum(c.session.requests for c in server.multi_clients.values())
+
+    print(f"requests        : {len(results)} ({args.concurrency} concurrent, {args.clients} clients)")
+    print(f"delivered       : {total / 1048576:.1f} MB in {elapsed:.2f} s -> {total / 1048576 / elapsed:.2f} MB/s")
+    print(f"upstream        : {upstream / 1048576:.1f} MB in {calls} GetFile calls")
+    print(f"ttfb p50 / p99  : {percentile(ttfbs, 50):.1f} ms / {percentile(ttfbs, 99):.1f} ms")
+    # ru_maxrss is in KB; what the chunk cache filled isn't per-stream memory
+    growth = (rss_after - rss_before) / 1024
+    buffers = max(0.0, growth - chunk_cache.size / 1048576)
+    print(f"peak rss growth : {growth:.1f} MB ({chunk_cache.size / 1048576:.1f} MB chunk cache, ~{buffers / args.concurrency:.2f} MB per stream)")
+    print(f"chunk cache     : {chunk_cache.stats()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline /dl streaming benchmark against a fake Telegram file server.")
+    parser.add_argument("--files", type=int, default=4, help="number of synthetic files")
+    parser.add_argument("--size-mb", type=float, default=32, help="size of each file in MB")
+    parser.add_argument("--clients", type=int, default=1, help="fake MULTI_TOKEN clients")
+    parser.add_argument("--requests", type=int, default=32, help="total HTTP requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight at once")
+    parser.add_argument("--latency-ms", type=float, default=80, help="GetFile round-trip latency")
+    parser.add_argument("--bandwidth-mbps", type=float, default=80, help="bandwidth per media session (Mbit/s)")
+    parser.add_argument("--lookup-ms", type=float, default=60, help="get_messages latency")
+    parser.add_argument("--range-every", type=int, default=4, help="every Nth request is a range probe (0 = none)")
+    parser.add_argument("--range-kb", type=int, default=256, help="size of range probes in KB")
+    parser.add_argument("--no-cache", action="store_true", help="disable the shared chunk cache")
+    parser.add_argument("--port", type=int, default=8765)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    sys.exit(main())
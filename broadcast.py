@@ -0,0 +1,104 @@
+# broadcast.py
+
+import asyncio
+import time
+
+from pyrogram.errors import FloodWait, UserIsBlocked, InputUserDeactivated, UserDeactivated, PeerIdInvalid
+
+from config import Config
+from database import db
+from metrics import FLOOD_WAITS
+
+class TokenBucket:
+    """Allows `rate` sends per second with bursts up to `capacity`; pause() stops everyone for a FloodWait."""
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class Broadcaster:
+    """
+    Sends one broadcast to every user, streaming ids from Mongo in batches.
+    Each batch is sent concurrently behind a shared token bucket, and progress
+    is saved after every batch so an interrupted run can resume where it stopped.
+    """
+    def __init__(self, bot, status_msg, state: dict):
+        self.bot = bot
+        self.status_msg = status_msg
+        self.state = state
+        self.bucket = TokenBucket(Config.BROADCAST_RATE, Config.BROADCAST_RATE)
+        self.sem = asyncio.Semaphore(Config.BROADCAST_CONCURRENCY)
+        self.last_edit = 0.0
+
+    async def send(self, user_id):
+        async with self.sem:
+            for _ in range(3):
+                await self.bucket.acquire()
+                try:
+                    await self.bot.send_message(user_id, self.state['text'])
+                    return 'done'
+                except FloodWait as e:
+                    FLOOD_WAITS.labels(source="broadcast").inc()
+                    self.bucket.pause(e.value)
+                except (UserIsBlocked, InputUserDeactivated, UserDeactivated, PeerIdInvalid):
+                    return 'blocked'
+                except Exception:
+                    return 'failed'
+            return 'failed'
+
+    async def run(self):
+        batch = []
+        async for user_id in db.iter_user_ids(after=self.state.get('last_user_id')):
+            batch.append(user_id)
+            if len(batch) >= Config.BROADCAST_BATCH:
+                await self.send_batch(batch)
+                batch = []
+        if batch: await self.send_batch(batch)
+        self.state['finished'] = True
+        await db.update_broadcast(self.state['_id'], finished=True)
+        await self.report(final=True)
+
+    async def send_batch(self, batch):
+        results = await asyncio.gather(*[self.send(user_id) for user_id in batch])
+        for result in results: self.state[result] = self.state.get(result, 0) + 1
+        self.state['last_user_id'] = batch[-1]
+        await db.update_broadcast(
+            self.state['_id'],
+            last_user_id=batch[-1],
+            done=self.state.get('done', 0),
+            failed=self.state.get('failed', 0),
+            blocked=self.state.get('blocked', 0),
+        )
+        await self.report()
+
+    async def report(self, final=False):
+        now = time.monotonic()
+        if not final and now - self.last_edit < Config.BROADCAST_EDIT_INTERVAL: return
+        self.last_edit = now
+        title = "✅ **Done**" if final else "⏳ **Broadcasting...**"
+        try:
+            await self.status_msg.edit(
+                f"{title}\nSuccess: {self.state.get('done', 0)}\n"
+                f"Blocked: {self.state.get('blocked', 0)}\nFailed: {self.state.get('failed', 0)}"
+            )
+        except Exception: pass
@@ -0,0 +1,249 @@
+# cache.py
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from config import Config
+
+class ChunkCache:
+    """
+    In-process LRU of downloaded file chunks, bounded by total bytes.
+    Concurrent misses for the same key share one upstream fetch.
+    """
+    def __init__(self, max_bytes: int, disk=None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.size = 0
+        self._chunks = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.cancelled = 0
+        self._waiters = {}
+
+    def get(self, key):
+        chunk = self._chunks.get(key)
+        if chunk is not None: self._chunks.move_to_end(key)
+        return chunk
+
+    def put(self, key, chunk: bytes):
+        if not chunk or len(chunk) > self.max_bytes: return
+        old = self._chunks.pop(key, None)
+        if old is not None: self.size -= len(old)
+        self._chunks[key] = chunk
+        self.size += len(chunk)
+        while self.size > self.max_bytes:
+            _, evicted = self._chunks.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    async def get_or_fetch(self, key, fetch):
+        """Returns the cached chunk for `key`, or awaits `fetch()` once for all concurrent callers."""
+        chunk = self.get(key)
+        if chunk is not None:
+            self.hits += 1
+            return chunk
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.create_task(self._fetch(key, fetch))
+            # Mark the error as retrieved in case every waiter has already gone away
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        # Shielded so one viewer disconnecting doesn't cancel the fetch the others wait on;
+        # the fetch itself is only cancelled once nobody is waiting for it
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1 and not task.done():
+                # Unlist it now so a viewer arriving before it winds down starts a fresh fetch
+                self._inflight.pop(key, None)
+                task.cancel()
+                self.cancelled += 1
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]: del self._waiters[key]
+
+    async def _fetch(self, key, fetch):
+        try:
+            chunk = await self.disk.get(key) if self.disk else None
+            if chunk is None:
+                chunk = await fetch()
+                if self.disk: self.disk.put(key, chunk)
+            self.put(key, chunk)
+            return chunk
+        finally:
+            # A cancelled fetch may already have been replaced by a newer one
+            if self._inflight.get(key) is asyncio.current_task(): del self._inflight[key]
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "cancelled": self.cancelled,
+            "entries": len(self._chunks),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
+
+class DiskChunkCache:
+    """
+    Second chunk tier on local disk, one file per chunk, bounded by total bytes.
+    File mtimes double as the LRU order, so the index is rebuilt from the
+    directory on restart. All file I/O runs in worker threads.
+    """
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._files = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.path and self.max_bytes > 0: self._load()
+
+    def reopen(self, path: str, max_bytes: int):
+        """Switches to another directory and budget, e.g. a worker's own slice in multi-process mode."""
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._files = OrderedDict()
+        if self.path and self.max_bytes > 0: self._load()
+
+    @staticmethod
+    def _name(key):
+        return "_".join(str(part) for part in key) + ".chunk"
+
+    def _load(self):
+        os.makedirs(self.path, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".tmp"): os.unlink(entry.path)  # interrupted write
+            elif entry.name.endswith(".chunk"):
+                st = entry.stat()
+                found.append((st.st_mtime, entry.name, st.st_size))
+        for _, name, size in sorted(found):
+            self._files[name] = size
+            self.size += size
+        for name in self._evict(): os.unlink(os.path.join(self.path, name))
+        print(f"💾 Disk cache: {len(self._files)} chunks, {self.size // 1048576} MB in {self.path}")
+
+    def _evict(self):
+        evicted = []
+        while self.size > self.max_bytes:
+            name, size = self._files.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            evicted.append(name)
+        return evicted
+
+    def _read(self, name):
+        path = os.path.join(self.path, name)
+        with open(path, "rb") as f: chunk = f.read()
+        os.utime(path)  # keep the LRU order across restarts
+        return chunk
+
+    def _write(self, name, chunk, evicted):
+        path = os.path.join(self.path, name)
+        with open(path + ".tmp", "wb") as f: f.write(chunk)
+        os.replace(path + ".tmp", path)
+        for old in evicted:
+            try: os.unlink(os.path.join(self.path, old))
+            except FileNotFoundError: pass
+
+    async def get(self, key):
+        name = self._name(key)
+        if name not in self._files:
+            self.misses += 1
+            return None
+        self._files.move_to_end(name)
+        try: chunk = await asyncio.to_thread(self._read, name)
+        except OSError:
+            # Still being written, or removed behind our back
+            self.misses += 1
+            return None
+        self.hits += 1
+        return chunk
+
+    def put(self, key, chunk: bytes):
+        """Indexes the chunk now and writes it to disk in the background."""
+        if not self.path or not chunk or len(chunk) > self.max_bytes: return
+        name = self._name(key)
+        if name in self._files: return
+        self._files[name] = len(chunk)
+        self.size += len(chunk)
+        asyncio.create_task(self._store(name, chunk, self._evict()))
+
+    async def _store(self, name, chunk, evicted):
+        try: await asyncio.to_thread(self._write, name, chunk, evicted)
+        except OSError as e:
+            print(f"⚠️ Disk cache write failed: {e}")
+            if self._files.pop(name, None) is not None: self.size -= len(chunk)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._files),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
+
+class FileMeta:
+    """Decoded media details of one storage-channel message."""
+    def __init__(self, msg_id, file_size, mime_type, file_name, file_unique_id):
+        self.msg_id = msg_id
+        self.file_size = file_size
+        self.mime_type = mime_type
+        self.file_name = file_name
+        self.file_unique_id = file_unique_id
+        # file_id (and its access hash) is issued per bot token, so keep one per client
+        self.file_ids = {}
+        self.created = time.monotonic()
+        self.warmed = False
+
+class MetaCache:
+    """Bounded TTL cache of FileMeta keyed by storage-channel message id."""
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, msg_id):
+        meta = self._entries.get(msg_id)
+        if meta is None: return None
+        if time.monotonic() - meta.created > self.ttl:
+            del self._entries[msg_id]
+            return None
+        self._entries.move_to_end(msg_id)
+        return meta
+
+    def put(self, meta: FileMeta):
+        self._entries[meta.msg_id] = meta
+        self._entries.move_to_end(meta.msg_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, msg_id):
+        self._entries.pop(msg_id, None)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+disk_cache = DiskChunkCache(Config.DISK_CACHE_DIR, Config.DISK_CACHE_MB * 1024 * 1024) if Config.DISK_CACHE_DIR else None
+chunk_cache = ChunkCache(Config.CHUNK_CACHE_MB * 1024 * 1024, disk=disk_cache)
+meta_cache = MetaCache(Config.META_CACHE_SIZE, Config.META_CACHE_TTL)
@@ -0,0 +1,198 @@
+# cluster.py
+
+import os
+import time
+import math
+import hashlib
+import signal
+import socket
+import struct
+import multiprocessing
+from contextlib import aclosing
+from multiprocessing import shared_memory
+
+import httpx
+import uvicorn
+
+from config import Config
+from cache import chunk_cache, disk_cache
+from admission import admission
+from responses import ClosingStreamingResponse
+
+HOP_HEADER = "x-cluster-hop"
+SLOT = struct.Struct("dd")  # open streams, streaming clients
+
+def _stop(*_):
+    raise KeyboardInterrupt
+
+class Cluster:
+    """
+    Multi-process serving mode (WEB_PROCESSES > 1). The supervisor forks one uvicorn
+    worker per process, all accepting on the same listening socket. MULTI_TOKEN clients
+    are sharded across workers, and each worker publishes its open streams and client
+    count into a shared-memory table. Every file has an owner worker (rendezvous hash
+    of msg_id), so its viewers share one worker's caches and single-flight fetches;
+    a /dl request is proxied over a unix socket to the owner, or to the least-loaded
+    worker when the owner is CLUSTER_SPILL streams per client busier. Only worker 0
+    runs the updates bot and the background jobs.
+    """
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self.index = 0
+        self.tag = os.getpid()
+        self.streams = 0
+        self.clients = 0
+        self._shm = None
+        self._http = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 1
+
+    @property
+    def is_primary(self) -> bool:
+        return self.index == 0
+
+    def owns(self, client_id: int) -> bool:
+        """Whether MULTI_TOKEN number `client_id` is started by this worker."""
+        return not self.enabled or client_id % self.size == self.index
+
+    def socket_path(self, index: int) -> str:
+        return os.path.join(Config.CLUSTER_SOCKET_DIR, f"stream-{self.tag}-{index}.sock")
+
+    # --- Shared workload table ---
+
+    def publish(self, streams=None, clients=None):
+        if streams is not None: self.streams = streams
+        if clients is not None: self.clients = clients
+        if self._shm: SLOT.pack_into(self._shm.buf, SLOT.size * self.index, self.streams, self.clients)
+
+    def loads(self):
+        return [SLOT.unpack_from(self._shm.buf, SLOT.size * i) for i in range(self.size)] if self._shm else []
+
+    @staticmethod
+    def _score(msg_id, index, clients) -> float:
+        # Weighted rendezvous hashing: a worker owns a share of files proportional to its clients
+        h = (int.from_bytes(hashlib.md5(f"{msg_id}:{index}".encode()).digest()[:8], "big") + 1) / 2 ** 64
+        return clients / -math.log(h)
+
+    def route(self, request, msg_id):
+        """Index of the worker that should stream `msg_id`, or None to serve it here."""
+        if not self.enabled or HOP_HEADER in request.headers: return None
+        # Per-client load of every worker that can stream; the +1 counts the stream being placed
+        table = {i: slot for i, slot in enumerate(self.loads()) if slot[1]}
+        if not table: return None
+        loads = {i: (streams + 1) / clients for i, (streams, clients) in table.items()}
+        owner = max(table, key=lambda i: self._score(msg_id, i, table[i][1]))
+        least = min(loads, key=lambda i: (loads[i], i != owner))
+        best = owner if loads[owner] - loads[least] <= Config.CLUSTER_SPILL else least
+        return None if best == self.index else best
+
+    async def track(self, body):
+        """Passes `body` through, counting it as an open stream of this worker meanwhile."""
+        self.publish(streams=self.streams + 1)
+        try:
+            async with aclosing(body):
+                async for chunk in body: yield chunk
+        finally:
+            self.publish(streams=self.streams - 1)
+
+    # --- Proxying to a sibling worker ---
+
+    def _client(self, index: int):
+        client = self._http.get(index)
+        if client is None:
+            client = httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(uds=self.socket_path(index)),
+                timeout=httpx.Timeout(Config.CONTROLLER_TIMEOUT, read=None),
+            )
+            self._http[index] = client
+        return client
+
+    async def proxy(self, request, index: int):
+        """Forwards `request` to worker `index` and streams its response back."""
+        http = self._client(index)
+        headers = [(k, v) for k, v in request.headers.raw if k.lower() not in (b"host", b"connection")]
+        headers.append((HOP_HEADER.encode(), str(self.index).encode()))
+        url = httpx.URL(f"http://worker{request.url.path}", query=request.url.query.encode())
+        upstream = await http.send(http.build_request(request.method, url, headers=headers, content=await request.body()), stream=True)
+        relay = {k: v for k, v in upstream.headers.items() if k.lower() not in ("connection", "transfer-encoding", "keep-alive")}
+        return ClosingStreamingResponse(self._relay(upstream), status_code=upstream.status_code, headers=relay)
+
+    @staticmethod
+    async def _relay(upstream):
+        try:
+            async for chunk in upstream.aiter_raw(): yield chunk
+        finally:
+            # Closing the unix-socket connection makes the sibling cancel its fetches too
+            await upstream.aclose()
+
+    async def close(self):
+        for client in self._http.values(): await client.aclose()
+        self._http.clear()
+
+    def stats(self):
+        return {i: {"streams": int(s), "clients": int(c)} for i, (s, c) in enumerate(self.loads())}
+
+    # --- Supervisor ---
+
+    def run(self, app, port: int):
+        """Forks the workers and keeps them running; blocks until SIGINT/SIGTERM."""
+        self.tag = os.getpid()
+        self._shm = shared_memory.SharedMemory(create=True, size=SLOT.size * self.size)
+        self._shm.buf[:] = bytes(SLOT.size * self.size)
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("0.0.0.0", port))
+        listener.listen(2048)
+        listener.set_inheritable(True)
+
+        ctx = multiprocessing.get_context("fork")
+        procs = {}
+        def spawn(i):
+            procs[i] = ctx.Process(target=self._serve, args=(i, app, listener), name=f"stream-worker-{i}", daemon=True)
+            procs[i].start()
+
+        signal.signal(signal.SIGTERM, _stop)
+        print(f"🧩 Starting {self.size} web processes on :{port}")
+        try:
+            for i in range(self.size): spawn(i)
+            while True:
+                time.sleep(1)
+                for i, proc in list(procs.items()):
+                    if not proc.is_alive():
+                        print(f"⚠️ Web process {i} exited ({proc.exitcode}), restarting")
+                        SLOT.pack_into(self._shm.buf, SLOT.size * i, 0, 0)
+                        spawn(i)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # A second SIGTERM mustn't interrupt the shutdown below
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            for proc in procs.values(): proc.terminate()
+            for proc in procs.values(): proc.join(10)
+            listener.close()
+            self._shm.close()
+            self._shm.unlink()
+            for i in range(self.size):
+                try: os.unlink(self.socket_path(i))
+                except FileNotFoundError: pass
+
+    def _serve(self, index: int, app, listener):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.index = index
+        self.streams = 0
+        self.publish()
+        # The memory budgets are for the whole container, so each worker gets its share
+        chunk_cache.max_bytes //= self.size
+        admission.budget //= self.size
+        # Each worker owns a slice of the disk tier; siblings never share an index
+        if disk_cache: disk_cache.reopen(os.path.join(Config.DISK_CACHE_DIR, f"worker-{index}"), disk_cache.max_bytes // self.size)
+        path = self.socket_path(index)
+        if os.path.exists(path): os.unlink(path)
+        local = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        local.bind(path)
+        local.listen(2048)
+        uvicorn.Server(uvicorn.Config(app, log_level="info")).run(sockets=[listener, local])
+
+cluster = Cluster(Config.WEB_PROCESSES)
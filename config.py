@@ -27,10 +27,25 @@ class Config:
             if clean_x.lstrip('-').isdigit():
                 AUTO_UPLOAD_CHANNELS.append(int(clean_x))
 
+    # Channel scanner: message ids fetched per page, and channels scanned at once
+    try: SCAN_PAGE_SIZE = min(200, int(os.environ.get("SCAN_PAGE_SIZE", 100)))
+    except: SCAN_PAGE_SIZE = 100
+
+    try: SCAN_CONCURRENCY = int(os.environ.get("SCAN_CONCURRENCY", 4))
+    except: SCAN_CONCURRENCY = 4
+
     ADMINS = [int(x) for x in os.environ.get("ADMINS", "").split()]
 
     BASE_URL = os.environ.get("BASE_URL", "").rstrip('/')
     DATABASE_URL = os.environ.get("DATABASE_URL", "")
+
+    # Seconds between batched writes of user activity (last_active, names)
+    try: USER_FLUSH_INTERVAL = int(os.environ.get("USER_FLUSH_INTERVAL", 30))
+    except: USER_FLUSH_INTERVAL = 30
+
+    # Fallback reload interval for the in-memory ban list when change streams aren't available
+    try: BAN_REFRESH_INTERVAL = int(os.environ.get("BAN_REFRESH_INTERVAL", 60))
+    except: BAN_REFRESH_INTERVAL = 60
     
     try: FORCE_SUB_CHANNEL = int(os.environ.get("FORCE_SUB_CHANNEL", 0))
     except: FORCE_SUB_CHANNEL = 0
@@ -42,6 +57,26 @@ class Config:
     raw_upload_urls = os.environ.get("HF_WORKERS", "") 
     HF_UPLOAD_WORKERS = [url.strip().rstrip('/') for url in raw_upload_urls.split(",") if url.strip()]
 
+    # Shared async HTTP client used for every controller call
+    try: CONTROLLER_TIMEOUT = float(os.environ.get("CONTROLLER_TIMEOUT", 10))
+    except: CONTROLLER_TIMEOUT = 10.0
+
+    try: CONTROLLER_MAX_CONNECTIONS = int(os.environ.get("CONTROLLER_MAX_CONNECTIONS", 20))
+    except: CONTROLLER_MAX_CONNECTIONS = 20
+
+    # Result delivery: shared secret for the /controller/results webhook,
+    # parallel chats, and the fallback poll interval range (seconds)
+    CONTROLLER_SECRET = os.environ.get("CONTROLLER_SECRET", "")
+
+    try: DELIVERY_CONCURRENCY = int(os.environ.get("DELIVERY_CONCURRENCY", 8))
+    except: DELIVERY_CONCURRENCY = 8
+
+    try: POLL_MIN_INTERVAL = float(os.environ.get("POLL_MIN_INTERVAL", 2))
+    except: POLL_MIN_INTERVAL = 2.0
+
+    try: POLL_MAX_INTERVAL = float(os.environ.get("POLL_MAX_INTERVAL", 30))
+    except: POLL_MAX_INTERVAL = 30.0
+
     # ---------------------------------------------------------
     # 🚀 STREAMING WORKERS (For File Streaming / Download) [NEW]
     # ---------------------------------------------------------
@@ -51,6 +86,122 @@ class Config:
         raw_stream_urls = os.environ.get("HF_STREAMING_WORKER", "") # Singular fallback
         
     HF_STREAMING_URLS = [url.strip().rstrip('/') for url in raw_stream_urls.split(",") if url.strip()]
+
+    # Streaming worker health probes (seconds)
+    try: WORKER_PROBE_INTERVAL = int(os.environ.get("WORKER_PROBE_INTERVAL", 30))
+    except: WORKER_PROBE_INTERVAL = 30
+
+    try: WORKER_PROBE_TIMEOUT = float(os.environ.get("WORKER_PROBE_TIMEOUT", 5))
+    except: WORKER_PROBE_TIMEOUT = 5.0
+
+    # Multi-process mode: web processes sharing the port (MULTI_TOKENs are split between
+    # them) and where their unix sockets for handing streams to each other live.
+    try: WEB_PROCESSES = int(os.environ.get("WEB_PROCESSES", 1))
+    except: WEB_PROCESSES = 1
+
+    CLUSTER_SOCKET_DIR = os.environ.get("CLUSTER_SOCKET_DIR", "/tmp")
+
+    # How many more streams per client a file's owner process may carry than the
+    # least-loaded one before its new viewers go elsewhere
+    try: CLUSTER_SPILL = float(os.environ.get("CLUSTER_SPILL", 2))
+    except: CLUSTER_SPILL = 2.0
+
+    # ---------------------------------------------------------
+    # ⚡ STREAMING ENGINE (Render fallback / ByteStreamer)
+    # ---------------------------------------------------------
+    # Number of 1 MB GetFile requests kept in flight per stream.
+    # Capped by STREAM_PREFETCH_MAX so one stream can't hold unbounded memory.
+    try: STREAM_PREFETCH = int(os.environ.get("STREAM_PREFETCH", 4))
+    except: STREAM_PREFETCH = 4
+
+    try: STREAM_PREFETCH_MAX = int(os.environ.get("STREAM_PREFETCH_MAX", 8))
+    except: STREAM_PREFETCH_MAX = 8
+
+    # Admission control for /dl: total prefetch memory across streams (MB), how many
+    # requests may queue for it and for how long, and the Retry-After sent when shed.
+    try: STREAM_MEMORY_MB = int(os.environ.get("STREAM_MEMORY_MB", 512))
+    except: STREAM_MEMORY_MB = 512
+
+    try: ADMISSION_QUEUE = int(os.environ.get("ADMISSION_QUEUE", 32))
+    except: ADMISSION_QUEUE = 32
+
+    try: ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 10))
+    except: ADMISSION_QUEUE_TIMEOUT = 10.0
+
+    try: ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 5))
+    except: ADMISSION_RETRY_AFTER = 5
+
+    # Seconds a client may take to accept one part before its stream stops prefetching
+    try: STREAM_SLOW_CONSUMER = float(os.environ.get("STREAM_SLOW_CONSUMER", 2))
+    except: STREAM_SLOW_CONSUMER = 2.0
+
+    # Shared in-memory chunk cache (MB). Viewers of the same file reuse fetched chunks.
+    try: CHUNK_CACHE_MB = int(os.environ.get("CHUNK_CACHE_MB", 256))
+    except: CHUNK_CACHE_MB = 256
+
+    # Disk tier under the chunk cache; kept across restarts. Empty DISK_CACHE_DIR disables it.
+    DISK_CACHE_DIR = os.environ.get("DISK_CACHE_DIR", "")
+    try: DISK_CACHE_MB = int(os.environ.get("DISK_CACHE_MB", 4096))
+    except: DISK_CACHE_MB = 4096
+
+    # How many times one stream may refresh an expired file reference before giving up
+    try: STREAM_MAX_RECOVERIES = int(os.environ.get("STREAM_MAX_RECOVERIES", 3))
+    except: STREAM_MAX_RECOVERIES = 3
+
+    # Prefetch the first and last 1 MB of video/audio files when /show is rendered or /dl is first hit
+    STREAM_WARMUP = os.environ.get("STREAM_WARMUP", "true").lower() in ("1", "true", "yes")
+
+    # Client scheduler: bytes/s that count as one extra open stream, and how long errors weigh on a client
+    try: SCHED_STREAM_BPS = int(os.environ.get("SCHED_STREAM_BPS", 2 * 1024 * 1024))
+    except: SCHED_STREAM_BPS = 2 * 1024 * 1024
+
+    try: SCHED_ERROR_WINDOW = int(os.environ.get("SCHED_ERROR_WINDOW", 60))
+    except: SCHED_ERROR_WINDOW = 60
+
+    # DCs our storage channel's files live on; media sessions for them are built at startup
+    raw_media_dcs = os.environ.get("MEDIA_DC_IDS", "")
+    MEDIA_DC_IDS = [int(x) for x in raw_media_dcs.replace(",", " ").split() if x.isdigit()]
+
+    try: MEDIA_SESSIONS_PER_DC = int(os.environ.get("MEDIA_SESSIONS_PER_DC", 1))
+    except: MEDIA_SESSIONS_PER_DC = 1
+
+    # Cache-Control sent with /dl responses. Stored files are immutable, so let CDNs keep them.
+    DL_CACHE_CONTROL = os.environ.get("DL_CACHE_CONTROL", "public, max-age=31536000, immutable")
+
+    # Signed stream links. LINK_SECRET defaults to a key derived from BOT_TOKEN (links
+    # then break if the token is rotated, so permanent links use raw ids instead);
+    # LINK_TTL is in seconds (0 = never expire). Turn ALLOW_RAW_DL_IDS off once
+    # old /dl/{message_id} links no longer need to work.
+    LINK_SECRET = os.environ.get("LINK_SECRET", "")
+
+    try: LINK_TTL = int(os.environ.get("LINK_TTL", 0))
+    except: LINK_TTL = 0
+
+    ALLOW_RAW_DL_IDS = os.environ.get("ALLOW_RAW_DL_IDS", "true").lower() in ("1", "true", "yes")
+
+    # ---------------------------------------------------------
+    # 📢 BROADCAST (/all)
+    # ---------------------------------------------------------
+    # Messages per second (Telegram allows ~30/s for bots), parallel sends,
+    # users per saved checkpoint, and seconds between progress edits.
+    try: BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", 25))
+    except: BROADCAST_RATE = 25.0
+
+    try: BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", 10))
+    except: BROADCAST_CONCURRENCY = 10
+
+    try: BROADCAST_BATCH = int(os.environ.get("BROADCAST_BATCH", 100))
+    except: BROADCAST_BATCH = 100
+
+    try: BROADCAST_EDIT_INTERVAL = int(os.environ.get("BROADCAST_EDIT_INTERVAL", 15))
+    except: BROADCAST_EDIT_INTERVAL = 15
+
+    # Message metadata cache used by /dl and /show (entries, seconds)
+    try: META_CACHE_SIZE = int(os.environ.get("META_CACHE_SIZE", 10000))
+    except: META_CACHE_SIZE = 10000
+
+    try: META_CACHE_TTL = int(os.environ.get("META_CACHE_TTL", 1800))
+    except: META_CACHE_TTL = 1800
     
     # 🔍 Debugging Prints
     if not HF_UPLOAD_WORKERS:
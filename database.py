@@ -1,7 +1,9 @@
 # database.py
 
+import asyncio
 import motor.motor_asyncio
 import datetime
+from pymongo import UpdateOne
 from config import Config
 
 class Database:
@@ -10,6 +12,14 @@ class Database:
         self.db = None
         self.col_links = None
         self.col_users = None
+        self.col_broadcasts = None
+        self.col_channels = None
+        # Write-behind buffer of user activity: user_id -> latest fields to $set
+        self._pending_users = {}
+        self._flush_task = None
+        # Banned user ids, kept in memory so ban checks cost no round trip
+        self.banned_ids = set()
+        self._ban_task = None
 
     async def connect(self):
         if Config.DATABASE_URL:
@@ -18,9 +28,24 @@ class Database:
             self.db = self._client["StreamLinksDB"]
             self.col_links = self.db["links"]
             self.col_users = self.db["users"]
+            self.col_broadcasts = self.db["broadcasts"]
+            self.col_channels = self.db["channels"]
+            self._flush_task = asyncio.create_task(self._flush_users_periodically())
+            loaded = True
+            try: await self.load_banned_ids()
+            except Exception as e:
+                loaded = False
+                print(f"❌ Initial ban list load failed: {e}")
+            # Started either way; it retries a failed first load
+            self._ban_task = asyncio.create_task(self._sync_banned_ids(reload=not loaded))
             print("✅ Database connection established.")
 
     async def disconnect(self):
+        tasks = [t for t in (self._flush_task, self._ban_task) if t]
+        for task in tasks: task.cancel()
+        # Let a cancelled periodic flush put its batch back before the final flush
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.flush_users()
         if self._client: self._client.close()
 
     # --- LINK METHODS ---
@@ -34,36 +59,97 @@ class Database:
             return doc.get('message_id') if doc else None
         return None
 
+    async def get_link_info(self, unique_id):
+        """The whole link document, including any stored media metadata."""
+        if self.col_links is not None:
+            return await self.col_links.find_one({'_id': unique_id})
+        return None
+
+    async def update_link_media(self, unique_id, **media):
+        """Backfills media metadata on links saved before it was stored."""
+        if self.col_links is not None:
+            await self.col_links.update_one({'_id': unique_id}, {'$set': media})
+
     # --- USER & BAN SYSTEM ---
     async def add_user(self, user_id, first_name, username):
-        """Adds or updates a user."""
+        """Adds or updates a user. Buffered in memory and written by flush_users()."""
         if self.col_users is not None:
-            user_data = {
-                '_id': user_id,
+            self._pending_users[user_id] = {
                 'first_name': first_name,
                 'username': username,
                 'last_active': datetime.datetime.now()
             }
-            await self.col_users.update_one({'_id': user_id}, {'$set': user_data}, upsert=True)
+
+    async def flush_users(self):
+        """Writes all buffered user activity in one unordered bulk upsert."""
+        if self.col_users is None or not self._pending_users: return
+        pending, self._pending_users = self._pending_users, {}
+        ops = [UpdateOne({'_id': user_id}, {'$set': data}, upsert=True) for user_id, data in pending.items()]
+        try:
+            await self.col_users.bulk_write(ops, ordered=False)
+        except BaseException as e:
+            # Put them back unless newer activity arrived meanwhile (also when cancelled mid-write)
+            for user_id, data in pending.items(): self._pending_users.setdefault(user_id, data)
+            if not isinstance(e, Exception): raise
+            print(f"❌ User flush failed ({len(ops)} users): {e}")
+
+    async def _flush_users_periodically(self):
+        while True:
+            await asyncio.sleep(Config.USER_FLUSH_INTERVAL)
+            await self.flush_users()
 
     async def is_user_banned(self, user_id):
-        if self.col_users is not None:
-            user = await self.col_users.find_one({'_id': user_id})
-            return user.get('banned', False) if user else False
-        return False
+        return user_id in self.banned_ids
 
     async def ban_user(self, user_id):
         if self.col_users is not None:
             await self.col_users.update_one({'_id': user_id}, {'$set': {'banned': True}}, upsert=True)
+            self.banned_ids.add(user_id)
 
     async def unban_user(self, user_id):
         if self.col_users is not None:
             await self.col_users.update_one({'_id': user_id}, {'$set': {'banned': False}})
+            self.banned_ids.discard(user_id)
+
+    async def load_banned_ids(self):
+        if self.col_users is not None:
+            self.banned_ids = {user['_id'] async for user in self.col_users.find({'banned': True}, {'_id': 1})}
+
+    async def _sync_banned_ids(self, reload=False):
+        """
+        Keeps banned_ids in step with bans made by other processes. Uses a change
+        stream when the server supports one (replica sets / Atlas), otherwise
+        reloads the set every BAN_REFRESH_INTERVAL seconds.
+        """
+        pipeline = [{'$match': {'$or': [
+            {'operationType': 'insert', 'fullDocument.banned': {'$exists': True}},
+            {'updateDescription.updatedFields.banned': {'$exists': True}},
+        ]}}]
+        try:
+            async with self.col_users.watch(pipeline) as stream:
+                # Loaded after the stream opens, so no ban in between is missed
+                if reload: await self.load_banned_ids()
+                async for change in stream:
+                    if change['operationType'] == 'insert': banned = change['fullDocument'].get('banned')
+                    else: banned = change['updateDescription']['updatedFields'].get('banned')
+                    user_id = change['documentKey']['_id']
+                    if banned: self.banned_ids.add(user_id)
+                    else: self.banned_ids.discard(user_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Ban change stream unavailable ({e}). Falling back to periodic refresh.")
+        while True:
+            await asyncio.sleep(Config.BAN_REFRESH_INTERVAL)
+            try: await self.load_banned_ids()
+            except Exception as e: print(f"❌ Ban list refresh failed: {e}")
     
     async def get_user_by_username(self, username):
         """Find a user ID by their username."""
         if self.col_users is not None:
             username = username.lstrip('@')
+            for user_id, data in self._pending_users.items():
+                if (data.get('username') or '').lower() == username.lower(): return user_id
             user = await self.col_users.find_one({'username': {'$regex': f'^{username}$', '$options': 'i'}})
             return user['_id'] if user else None
         return None
@@ -73,4 +159,46 @@ class Database:
             return await self.col_users.count_documents({})
         return 0
 
+    async def iter_user_ids(self, after=None):
+        """Streams user ids in ascending order, optionally starting after a given id."""
+        if self.col_users is None: return
+        query = {'_id': {'$gt': after}} if after is not None else {}
+        async for user in self.col_users.find(query, {'_id': 1}).sort('_id', 1):
+            yield user['_id']
+
+    # --- BROADCAST PROGRESS ---
+    async def create_broadcast(self, text):
+        state = {'text': text, 'last_user_id': None, 'done': 0, 'failed': 0, 'blocked': 0, 'finished': False, 'created': datetime.datetime.now()}
+        if self.col_broadcasts is not None:
+            await self.col_broadcasts.insert_one(state)
+        return state
+
+    async def update_broadcast(self, broadcast_id, **fields):
+        if self.col_broadcasts is not None and broadcast_id is not None:
+            await self.col_broadcasts.update_one({'_id': broadcast_id}, {'$set': fields})
+
+    async def get_unfinished_broadcast(self):
+        """Latest broadcast that was interrupted before reaching the last user."""
+        if self.col_broadcasts is not None:
+            return await self.col_broadcasts.find_one({'finished': False}, sort=[('created', -1)])
+        return None
+
+    # --- CHANNEL SCANNER WATERMARKS ---
+    async def get_watermark(self, chat_id):
+        """Highest message id the scanner has processed in this channel, or None."""
+        if self.col_channels is not None:
+            doc = await self.col_channels.find_one({'_id': chat_id})
+            return doc.get('last_message_id') if doc else None
+        return None
+
+    async def set_watermark(self, chat_id, message_id):
+        if self.col_channels is not None:
+            # $max so a late or concurrent write can never move the watermark back
+            await self.col_channels.update_one({'_id': chat_id}, {'$max': {'last_message_id': message_id}}, upsert=True)
+
+    async def init_watermark(self, chat_id, message_id):
+        """Sets the starting watermark only if the channel has none yet."""
+        if self.col_channels is not None:
+            await self.col_channels.update_one({'_id': chat_id}, {'$setOnInsert': {'last_message_id': message_id}}, upsert=True)
+
 db = Database()
@@ -0,0 +1,97 @@
+# delivery.py
+
+import asyncio
+from collections import deque
+
+from pyrogram.errors import FloodWait
+
+from metrics import FLOOD_WAITS
+
+class ResultDelivery:
+    """
+    Delivers finished controller results to Telegram.
+    Each chat gets its own ordered queue and different chats are served
+    concurrently (bounded by `concurrency`). Delivered ids are ACKed to the
+    controller in batches; failed ones are left for the controller to resend.
+    Ids already queued or awaiting ACK are ignored, so the same result
+    arriving by push and by poll is only sent once.
+    """
+    def __init__(self, deliver, ack, concurrency: int = 8, ack_delay: float = 1.0):
+        self._deliver = deliver
+        self._ack = ack
+        self._sem = asyncio.Semaphore(concurrency)
+        self._ack_delay = ack_delay
+        self._queues = {}
+        self._workers = {}
+        self._known_ids = set()
+        self._done_ids = []
+        self._ack_task = None
+        self.delivered = 0
+        self.failed = 0
+        self.last_push = 0.0  # monotonic time of the last webhook push
+
+    @property
+    def pending(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def submit(self, messages) -> int:
+        """Queues controller messages; returns how many were new."""
+        accepted = 0
+        for msg in messages:
+            msg_id = msg.get('id')
+            if msg_id is None or msg_id in self._known_ids: continue
+            self._known_ids.add(msg_id)
+            chat_id = int(msg.get('chat_id', 0))
+            self._queues.setdefault(chat_id, deque()).append(msg)
+            if chat_id not in self._workers:
+                self._workers[chat_id] = asyncio.create_task(self._run_chat(chat_id))
+            accepted += 1
+        return accepted
+
+    async def _run_chat(self, chat_id):
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                msg = queue.popleft()
+                async with self._sem:
+                    ok = await self._deliver_one(msg)
+                if ok:
+                    self._done_ids.append(msg['id'])
+                    self._schedule_ack()
+                else:
+                    # Not ACKed, so the Controller hands it out again on a later poll
+                    self._known_ids.discard(msg['id'])
+        finally:
+            self._workers.pop(chat_id, None)
+            if not queue: self._queues.pop(chat_id, None)
+
+    async def _deliver_one(self, msg):
+        for _ in range(2):
+            try:
+                await self._deliver(msg)
+                self.delivered += 1
+                return True
+            except FloodWait as e:
+                FLOOD_WAITS.labels(source="delivery").inc()
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                print(f"❌ Processing Message Error: {e}")
+                break
+        self.failed += 1
+        return False
+
+    def _schedule_ack(self):
+        if self._ack_task is None or self._ack_task.done():
+            self._ack_task = asyncio.create_task(self._flush_acks())
+
+    async def _flush_acks(self):
+        # Short delay so results finishing together share one ACK call
+        await asyncio.sleep(self._ack_delay)
+        ids, self._done_ids = self._done_ids, []
+        if not ids: return
+        if await self._ack(ids):
+            self._known_ids.difference_update(ids)
+        else:
+            # Keep them marked as known and retry shortly
+            self._done_ids = ids + self._done_ids
+            asyncio.get_running_loop().call_later(5, self._schedule_ack)
@@ -0,0 +1,64 @@
+# http_client.py
+
+import asyncio
+import random
+
+import httpx
+
+from config import Config
+
+class ControllerClient:
+    """
+    One shared async HTTP client for all traffic to HF_UPLOAD_WORKERS.
+    Connections are kept alive and pooled, and failed calls are retried with
+    jittered exponential backoff, so controller I/O never blocks the event loop.
+    """
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    # A POST may already have been acted on, so it is only retried when it surely wasn't
+    POST_RETRY_STATUSES = {429, 503}
+    POST_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+    def __init__(self):
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(Config.CONTROLLER_TIMEOUT),
+                limits=httpx.Limits(max_connections=Config.CONTROLLER_MAX_CONNECTIONS, max_keepalive_connections=Config.CONTROLLER_MAX_CONNECTIONS),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None: await self._client.aclose()
+        self._client = None
+
+    async def request(self, method, url, retries=3, backoff=1.0, **kwargs) -> httpx.Response:
+        """
+        Sends a request, retrying on connection errors and 429/5xx replies.
+        POSTs are retried only on connect failures and 429/503, so a slow
+        Controller that already took a job doesn't get it twice.
+        Returns the last response, or raises the last error if no response came back.
+        """
+        post = method.upper() == "POST"
+        statuses = self.POST_RETRY_STATUSES if post else self.RETRY_STATUSES
+        errors = self.POST_RETRY_ERRORS if post else httpx.HTTPError
+        last_error = None
+        resp = None
+        for attempt in range(retries):
+            try:
+                resp = await self.client.request(method, url, **kwargs)
+                if resp.status_code not in statuses: return resp
+            except errors as e:
+                last_error = e
+            if attempt < retries - 1:
+                await asyncio.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+        if resp is not None: return resp
+        raise last_error
+
+    async def get(self, url, **kwargs): return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs): return await self.request("POST", url, **kwargs)
+
+controller = ControllerClient()
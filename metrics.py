@@ -0,0 +1,76 @@
+# metrics.py
+# Prometheus metrics for the streaming and bot hot paths, served at /metrics.
+
+import time
+from contextlib import aclosing
+
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from cache import chunk_cache, meta_cache, disk_cache
+from admission import admission
+
+BYTES_STREAMED = Counter("stream_bytes_total", "Bytes sent to HTTP clients", ["client"])
+GETFILE_LATENCY = Histogram(
+    "getfile_seconds", "upload.GetFile round-trip time", ["dc"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+DL_TTFB = Histogram(
+    "dl_ttfb_seconds", "Time from /dl request to first body byte",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+CONTROLLER_DISPATCH = Counter("controller_dispatch_total", "Upload jobs sent to the Controller", ["outcome"])
+FLOOD_WAITS = Counter("flood_waits_total", "FloodWait errors received from Telegram", ["source"])
+STREAM_ABORTS = Counter("stream_aborts_total", "Streaming responses cut short by a client disconnect")
+ABORTED_BYTES = Counter("stream_aborted_bytes_total", "Response bytes left unsent because the client disconnected")
+
+async def observe_ttfb(body, started: float):
+    """Passes `body` through, recording the time until its first chunk."""
+    first = True
+    async with aclosing(body):
+        async for chunk in body:
+            if first:
+                DL_TTFB.observe(time.monotonic() - started)
+                first = False
+            yield chunk
+
+class RuntimeCollector:
+    """Exports counters that already live on runtime objects (caches, work_loads) at scrape time."""
+    def __init__(self, work_loads: dict, stream_stats: dict):
+        self.work_loads = work_loads
+        self.stream_stats = stream_stats
+
+    def collect(self):
+        active = GaugeMetricFamily("active_streams", "Open streams per multi_clients index", labels=["client"])
+        for index, count in self.work_loads.items(): active.add_metric([str(index)], count)
+        yield active
+
+        cache = CounterMetricFamily("cache_requests", "Cache lookups by result", labels=["cache", "result"])
+        chunk = chunk_cache.stats()
+        for result in ("hits", "misses", "coalesced"): cache.add_metric(["chunk", result], chunk[result])
+        meta = meta_cache.stats()
+        for result in ("hits", "misses"): cache.add_metric(["meta", result], meta[result])
+        if disk_cache:
+            disk = disk_cache.stats()
+            for result in ("hits", "misses"): cache.add_metric(["disk", result], disk[result])
+        yield cache
+
+        yield CounterMetricFamily("chunk_cache_evictions", "Chunks evicted from the memory cache", value=chunk["evictions"])
+        yield GaugeMetricFamily("chunk_cache_bytes", "Bytes held by the chunk cache", value=chunk["bytes"])
+        if disk_cache: yield GaugeMetricFamily("disk_cache_bytes", "Bytes held by the disk chunk tier", value=disk["bytes"])
+        load = admission.stats()
+        yield GaugeMetricFamily("admission_reserved_bytes", "Prefetch memory reserved by admitted /dl streams", value=load["reserved"])
+        yield GaugeMetricFamily("admission_queued", "/dl requests waiting for stream memory", value=load["queued"])
+        yield CounterMetricFamily("admission_shed", "/dl requests answered 503 for lack of stream memory", value=load["shed"])
+        yield CounterMetricFamily("slow_consumer_pauses", "Streams that stopped prefetching for a slow client", value=self.stream_stats["slow_consumer_pauses"])
+        yield CounterMetricFamily("getfile_cancelled", "Upstream GetFile calls cancelled because every reader left", value=chunk["cancelled"])
+        yield CounterMetricFamily("file_reference_recoveries", "Streams resumed after a file reference expired", value=self.stream_stats["reference_recoveries"])
+
+_runtime = None
+
+def register_runtime(work_loads: dict, stream_stats: dict):
+    """Registers the RuntimeCollector once, even if app.py is imported twice (as __main__ and as app)."""
+    global _runtime
+    if _runtime is not None: return
+    _runtime = RuntimeCollector(work_loads, stream_stats)
+    REGISTRY.register(_runtime)
@@ -0,0 +1,110 @@
+# ranges.py
+# HTTP Range handling for /dl (RFC 7233): parsing, validation, validators and multipart/byteranges bodies.
+
+import secrets
+from contextlib import aclosing
+
+MAX_RANGES = 16  # more ranges than this in one request is treated as no Range header
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested ranges overlap the file. Answer with 416."""
+
+def parse_range_header(header, file_size):
+    """
+    Turns a Range header into a list of inclusive (start, end) byte pairs.
+    Returns None when the header is absent, malformed or not in bytes, so the
+    whole file is served. Raises RangeNotSatisfiable when no range fits the file.
+    Overlapping and adjacent ranges are merged and sorted (RFC 7233 §6.1), so
+    repeating a range can't make one request stream the file many times over.
+    """
+    if not header: return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec: return None
+
+    specs = [x.strip() for x in spec.split(",") if x.strip()]
+    if not specs or len(specs) > MAX_RANGES: return None
+
+    ranges = []
+    for item in specs:
+        first, sep, last = item.partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or not (first.isdigit() or last.isdigit()): return None
+        if first and last and not (first.isdigit() and last.isdigit()): return None
+
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length == 0: continue
+            start, end = max(0, file_size - length), file_size - 1
+        else:
+            start = int(first)
+            if last and int(last) < start: return None
+            if start >= file_size: continue
+            end = min(int(last), file_size - 1) if last else file_size - 1
+        ranges.append((start, end))
+
+    if not ranges: raise RangeNotSatisfiable
+    return merge_ranges(ranges)
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def make_etag(file_unique_id, file_size):
+    """Strong ETag for a stored file. Storage-channel files never change, so id + size is stable."""
+    return f'"{file_unique_id}-{file_size}"'
+
+def etag_matches(header, etag, weak=True):
+    """
+    True if an If-None-Match / If-Range style header names `etag`.
+    If-None-Match uses weak comparison; If-Range must use strong comparison.
+    """
+    if not header: return False
+    if header.strip() == "*": return True
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            if not weak: continue
+            tag = tag[2:]
+        if tag == etag: return True
+    return False
+
+def range_length(ranges):
+    return sum(end - start + 1 for start, end in ranges)
+
+class MultipartByteranges:
+    """Builds a multipart/byteranges body around per-range byte streams."""
+    def __init__(self, ranges, file_size, content_type):
+        self.ranges = ranges
+        self.file_size = file_size
+        self.part_type = content_type
+        self.boundary = secrets.token_hex(12)
+        self.content_type = f"multipart/byteranges; boundary={self.boundary}"
+
+    def part_header(self, start, end):
+        return (
+            f"\r\n--{self.boundary}\r\n"
+            f"Content-Type: {self.part_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{self.file_size}\r\n\r\n"
+        ).encode()
+
+    def closing(self):
+        return f"\r\n--{self.boundary}--\r\n".encode()
+
+    def content_length(self):
+        headers = sum(len(self.part_header(s, e)) for s, e in self.ranges)
+        return headers + range_length(self.ranges) + len(self.closing())
+
+    async def stream(self, open_range):
+        """`open_range(start, end)` must return an async iterator over that range's bytes."""
+        for start, end in self.ranges:
+            yield self.part_header(start, end)
+            async with aclosing(open_range(start, end)) as body:
+                async for chunk in body:
+                    yield chunk
+        yield self.closing()
@@ -0,0 +1,41 @@
+# responses.py
+
+import asyncio
+
+from fastapi.responses import StreamingResponse
+
+from metrics import STREAM_ABORTS, ABORTED_BYTES
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that watches for the client's disconnect itself and, however
+    the response ends, closes the body generator before returning. Pending GetFile
+    calls are cancelled and work_loads released the moment a player drops the
+    connection (e.g. to seek), instead of whenever the generator is collected.
+    """
+    async def __call__(self, scope, receive, send):
+        sent = 0
+
+        async def counting_send(message):
+            nonlocal sent
+            await send(message)
+            if message["type"] == "http.response.body": sent += len(message.get("body", b""))
+
+        stream = asyncio.create_task(self.stream_response(counting_send))
+        watch = asyncio.create_task(self.listen_for_disconnect(receive))
+        try:
+            await asyncio.wait({stream, watch}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (stream, watch): task.cancel()
+            await asyncio.gather(stream, watch, return_exceptions=True)
+            await self.body_iterator.aclose()
+
+        error = None if stream.cancelled() else stream.exception()
+        if stream.cancelled() or isinstance(error, OSError):
+            # Client went away mid-body
+            STREAM_ABORTS.inc()
+            length = self.headers.get("content-length")
+            if length: ABORTED_BYTES.inc(max(0, int(length) - sent))
+        elif error is not None:
+            raise error
+        if self.background is not None: await self.background()
@@ -0,0 +1,91 @@
+# scheduler.py
+
+import time
+from collections import deque
+
+from pyrogram.errors import FloodWait
+
+from config import Config
+from metrics import FLOOD_WAITS
+
+class ClientScheduler:
+    """
+    Routes new streams across multi_clients by headroom instead of open-stream count.
+    Each client's load combines open streams, recent throughput, recent errors and
+    whether it already has a media session for the file's DC. Clients sitting out a
+    FloodWait are skipped until the penalty expires.
+    """
+    WINDOW = 10  # seconds of throughput / error history kept per client
+
+    def __init__(self, clients: dict, work_loads: dict):
+        self.clients = clients
+        self.work_loads = work_loads
+        self._transfers = {}
+        self._errors = {}
+        self.flood_until = {}
+        self.flood_waits = 0
+
+    @staticmethod
+    def _prune(events: deque, now: float, window: float):
+        while events and now - events[0][0] > window:
+            events.popleft()
+
+    def record_bytes(self, index, n: int):
+        now = time.monotonic()
+        events = self._transfers.setdefault(index, deque())
+        events.append((now, n))
+        self._prune(events, now, self.WINDOW)
+
+    def record_error(self, index, error: Exception):
+        now = time.monotonic()
+        if isinstance(error, FloodWait):
+            self.flood_waits += 1
+            FLOOD_WAITS.labels(source="stream").inc()
+            self.flood_until[index] = max(self.flood_until.get(index, 0), now + int(error.value or 0))
+        events = self._errors.setdefault(index, deque())
+        events.append((now, 1))
+        self._prune(events, now, Config.SCHED_ERROR_WINDOW)
+
+    def throughput(self, index) -> float:
+        """Bytes per second served by a client over the last WINDOW seconds."""
+        events = self._transfers.get(index)
+        if not events: return 0.0
+        self._prune(events, time.monotonic(), self.WINDOW)
+        return sum(n for _, n in events) / self.WINDOW
+
+    def recent_errors(self, index) -> int:
+        events = self._errors.get(index)
+        if not events: return 0
+        self._prune(events, time.monotonic(), Config.SCHED_ERROR_WINDOW)
+        return len(events)
+
+    def load(self, index, dc_id=None) -> float:
+        score = self.work_loads.get(index, 0)
+        score += self.throughput(index) / Config.SCHED_STREAM_BPS
+        score += 2 * self.recent_errors(index)
+        client = self.clients.get(index)
+        if dc_id is not None and client is not None and dc_id not in client.media_sessions:
+            score += 0.5  # would have to build a media session first
+        return score
+
+    def pick(self, dc_id=None):
+        """Returns the index of the client with the most headroom, or None if there are no clients."""
+        if not self.clients: return None
+        now = time.monotonic()
+        ready = [i for i in self.clients if self.flood_until.get(i, 0) <= now]
+        if not ready:
+            # Everyone is flood-limited: take whoever is released first
+            return min(self.clients, key=lambda i: self.flood_until.get(i, 0))
+        return min(ready, key=lambda i: self.load(i, dc_id))
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            i: {
+                "streams": self.work_loads.get(i, 0),
+                "bps": int(self.throughput(i)),
+                "errors": self.recent_errors(i),
+                "flood_wait": max(0, int(self.flood_until.get(i, 0) - now)),
+            }
+            for i in self.clients
+        }
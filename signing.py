@@ -0,0 +1,61 @@
+# signing.py
+# Stateless stream links: the link itself carries what /show and /dl need, signed with a server secret.
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+from config import Config
+
+# Falls back to a key derived from the bot token so links survive restarts without extra setup.
+# Rotating BOT_TOKEN then invalidates every link, so permanent links need LINK_SECRET (see permanent_link).
+_SECRET = (Config.LINK_SECRET or f"stream-links:{Config.BOT_TOKEN}").encode()
+_SIG_BYTES = 16
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _sign(payload: bytes) -> bytes:
+    return hmac.new(_SECRET, payload, hashlib.sha256).digest()[:_SIG_BYTES]
+
+def sign_link(msg_id, file_size, mime_type, file_name=None, ttl=None):
+    """
+    Returns a URL-safe token for a storage-channel message.
+    `ttl` (seconds) defaults to Config.LINK_TTL; 0 means the link never expires.
+    """
+    ttl = Config.LINK_TTL if ttl is None else ttl
+    data = {"m": msg_id, "s": file_size, "t": mime_type}
+    if file_name: data["n"] = file_name
+    if ttl: data["e"] = int(time.time()) + ttl
+    payload = json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload))}"
+
+def permanent_link(msg_id, file_size, mime_type, file_name=None):
+    """
+    Link id for a link that must never expire. Without LINK_SECRET a ttl=0 token would
+    die with the current BOT_TOKEN, so the raw message id is used while ALLOW_RAW_DL_IDS is on.
+    """
+    if not Config.LINK_SECRET and Config.ALLOW_RAW_DL_IDS: return str(msg_id)
+    return sign_link(msg_id, file_size, mime_type, file_name, ttl=0)
+
+def verify_link(token):
+    """
+    Returns {"msg_id", "file_size", "mime_type", "file_name", "expires"} for a valid,
+    unexpired token, or None. `expires` is a unix time, or None for a permanent token.
+    Costs no database or Telegram call.
+    """
+    if not token or "." not in token: return None
+    try:
+        body, sig = token.split(".", 1)
+        payload = _b64decode(body)
+        if not hmac.compare_digest(_b64decode(sig), _sign(payload)): return None
+        data = json.loads(payload)
+    except Exception:
+        return None
+    if data.get("e") and data["e"] < time.time(): return None
+    return {"msg_id": int(data["m"]), "file_size": data.get("s"), "mime_type": data.get("t"), "file_name": data.get("n"), "expires": data.get("e")}
@@ -0,0 +1,251 @@
+# streamer.py
+
+import asyncio
+import time
+from collections import deque
+
+from pyrogram import Client, raw
+from pyrogram.errors import FileReferenceExpired, FileReferenceInvalid
+from pyrogram.file_id import FileId
+from pyrogram.session import Session, Auth
+
+from config import Config
+from cache import chunk_cache, meta_cache, FileMeta
+from metrics import BYTES_STREAMED, GETFILE_LATENCY
+
+# Process-wide streaming counters, shown in the /debug report
+stream_stats = {"reference_recoveries": 0, "warmups": 0, "slow_consumer_pauses": 0}
+
+# upload.GetFile rules: offset and limit divisible by 4 KB, 1 MB divisible by limit,
+# and no request may cross a 1 MB boundary
+GETFILE_ALIGN = 4 * 1024
+GETFILE_MAX = 1024 * 1024
+
+def prefetch_window():
+    return max(1, min(Config.STREAM_PREFETCH, Config.STREAM_PREFETCH_MAX))
+
+def buffer_bytes(start: int, end: int) -> int:
+    """Most bytes a stream of [start, end] can hold in fetched parts at once."""
+    return min(end // GETFILE_MAX - start // GETFILE_MAX + 1, prefetch_window()) * GETFILE_MAX
+
+def plan_parts(start: int, end: int):
+    """
+    Splits the inclusive byte range [start, end] into GetFile requests, giving each
+    1 MB block the range touches the smallest valid request that covers its slice.
+    Returns (offset, limit, cut_start, cut_end) tuples; the wanted bytes of each
+    part are chunk[cut_start:cut_end].
+    """
+    parts = []
+    pos = start
+    while pos <= end:
+        block_end = pos - pos % GETFILE_MAX + GETFILE_MAX
+        last = min(end, block_end - 1)
+        aligned = pos - pos % GETFILE_ALIGN
+        limit = GETFILE_ALIGN
+        while limit < last + 1 - aligned: limit *= 2
+        # Slide the request back if it would run past the block
+        offset = min(aligned, block_end - limit)
+        parts.append((offset, limit, pos - offset, last + 1 - offset))
+        pos = last + 1
+    return parts
+
+async def get_file_meta(client: Client, msg_id: int, refresh: bool = False):
+    """
+    Returns the cached FileMeta for a storage-channel message, fetching it from
+    Telegram only when missing, expired or lacking a file_id for this client.
+    """
+    meta = None if refresh else meta_cache.get(msg_id)
+    if meta and client in meta.file_ids:
+        meta_cache.hits += 1
+        return meta
+
+    meta_cache.misses += 1
+    msg = await client.get_messages(Config.STORAGE_CHANNEL, msg_id)
+    media = (msg.document or msg.video or msg.audio) if msg and not msg.empty else None
+    if not media: raise FileNotFoundError
+    return cache_media(client, msg_id, media, meta)
+
+def cache_media(client: Client, msg_id: int, media, meta: FileMeta = None):
+    """Stores a storage-channel message's media (as seen by `client`) in the meta cache."""
+    if meta is None:
+        meta = FileMeta(msg_id, media.file_size, media.mime_type, media.file_name, media.file_unique_id)
+        meta_cache.put(meta)
+    meta.file_ids[client] = FileId.decode(media.file_id)
+    return meta
+
+class MediaSessionPool:
+    """
+    Media sessions per (client, DC). Each pool is built once under its own lock,
+    so concurrent first requests never race to create duplicate sessions, and
+    streams are spread round-robin over MEDIA_SESSIONS_PER_DC sessions.
+    """
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._sessions = {}
+        self._locks = {}
+        self._turn = {}
+
+    async def get(self, client: Client, dc_id: int):
+        key = (client, dc_id)
+        sessions = self._sessions.get(key)
+        if not sessions:
+            async with self._locks.setdefault(key, asyncio.Lock()):
+                sessions = self._sessions.get(key) or await self._create(client, dc_id)
+        turn = self._turn.get(key, 0)
+        self._turn[key] = turn + 1
+        return sessions[turn % len(sessions)]
+
+    async def _create(self, client: Client, dc_id: int):
+        if dc_id == await client.storage.dc_id():
+            sessions = [client.session]
+        else:
+            existing = client.media_sessions.get(dc_id)
+            sessions = [existing] if existing else []
+            sessions += await asyncio.gather(*[self._new_session(client, dc_id) for _ in range(self.size - len(sessions))])
+        self._sessions[(client, dc_id)] = sessions
+        client.media_sessions[dc_id] = sessions[0]
+        return sessions
+
+    @staticmethod
+    async def _new_session(client: Client, dc_id: int):
+        test_mode = await client.storage.test_mode()
+        auth_key = await Auth(client, dc_id, test_mode).create()
+        ms = Session(client, dc_id, auth_key, test_mode, is_media=True)
+        await ms.start()
+        exp = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+        await ms.invoke(raw.functions.auth.ImportAuthorization(id=exp.id, bytes=exp.bytes))
+        return ms
+
+    async def warm(self, client: Client, dc_ids):
+        """Builds the pools for `dc_ids` ahead of the first request."""
+        for dc_id in dc_ids:
+            try: await self.get(client, dc_id)
+            except Exception as e: print(f"⚠️ Media session warm-up failed for {client.name} on DC {dc_id}: {e}")
+
+media_pool = MediaSessionPool(Config.MEDIA_SESSIONS_PER_DC)
+
+class ByteStreamer:
+    """Fetches file parts from Telegram, keeping a bounded window of GetFile calls in flight."""
+    def __init__(self, client: Client, work_loads: dict, scheduler=None):
+        self.client = client
+        self.work_loads = work_loads
+        self.scheduler = scheduler
+
+    @staticmethod
+    def get_location(file_id: FileId):
+        return raw.types.InputDocumentFileLocation(
+            id=file_id.media_id,
+            access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference,
+            thumb_size=file_id.thumbnail_size
+        )
+
+    async def get_media_session(self, file_id: FileId):
+        return await media_pool.get(self.client, file_id.dc_id)
+
+    async def fetch_chunk(self, index, ms, loc, offset, chunk_size):
+        started = time.monotonic()
+        r = await ms.invoke(raw.functions.upload.GetFile(location=loc, offset=offset, limit=chunk_size), retries=0)
+        GETFILE_LATENCY.labels(dc=str(ms.dc_id)).observe(time.monotonic() - started)
+        chunk = r.bytes if isinstance(r, raw.types.upload.File) else b""
+        if self.scheduler: self.scheduler.record_bytes(index, len(chunk))
+        return chunk
+
+    async def get_chunk(self, index, file_id, ms, loc, offset, chunk_size):
+        if chunk_size < GETFILE_MAX:
+            # A full 1 MB chunk around this part may already be cached
+            block = offset - offset % GETFILE_MAX
+            whole = chunk_cache.get((file_id.media_id, block, GETFILE_MAX))
+            if whole is not None:
+                chunk_cache.hits += 1
+                return whole[offset - block:offset - block + chunk_size]
+        key = (file_id.media_id, offset, chunk_size)
+        return await chunk_cache.get_or_fetch(key, lambda: self.fetch_chunk(index, ms, loc, offset, chunk_size))
+
+    async def warm_up(self, index, meta: FileMeta):
+        """
+        Pulls the first and last 1 MB of a video/audio file into the chunk cache,
+        so a player's opening probes (header, then MP4 moov / MKV cues) skip Telegram.
+        """
+        if meta.warmed or not meta.file_size or not (meta.mime_type or "").startswith(("video/", "audio/")): return
+        meta.warmed = True
+        try:
+            file_id = meta.file_ids[self.client]
+            ms = await self.get_media_session(file_id)
+            loc = self.get_location(file_id)
+            # The head block, plus the block(s) holding the final 1 MB of the file
+            tail = max(0, meta.file_size - GETFILE_MAX)
+            blocks = {0, tail - tail % GETFILE_MAX, (meta.file_size - 1) - (meta.file_size - 1) % GETFILE_MAX}
+            await asyncio.gather(*[self.get_chunk(index, file_id, ms, loc, offset, GETFILE_MAX) for offset in blocks])
+            stream_stats["warmups"] += 1
+        except Exception as e:
+            print(f"⚠️ Warm-up failed for {meta.msg_id}: {e}")
+
+    @staticmethod
+    def cancel_pending(pending):
+        for task in pending:
+            task.cancel()
+            # Retrieve errors of requests that already failed so they aren't logged as unhandled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        pending.clear()
+
+    async def yield_file(self, file_id, index, parts, msg_id=None):
+        """
+        Yields the planned parts (see plan_parts) in order while up to STREAM_PREFETCH
+        further parts are already being downloaded. At most `window` chunks are
+        buffered per stream, so memory stays at window * 1 MB. While the client
+        takes longer than STREAM_SLOW_CONSUMER seconds to accept a part, prefetching
+        stops and only the part it is about to need is fetched.
+
+        If the file reference expires mid-stream and `msg_id` is given, the message
+        is re-read for a fresh FileId and the download resumes at the current part.
+        """
+        self.work_loads[index] += 1
+        streamed = BYTES_STREAMED.labels(client=str(index))
+        window = prefetch_window()
+        pending = deque()
+        recoveries = 0
+        slow = False
+        try:
+            ms = await self.get_media_session(file_id)
+            loc = self.get_location(file_id)
+            curr = 0
+            while curr < len(parts):
+                # Top the window up before waiting on the oldest request
+                next_part = curr + len(pending)
+                while next_part < len(parts) and len(pending) < (1 if slow else window):
+                    part_offset, limit = parts[next_part][:2]
+                    pending.append(asyncio.create_task(self.get_chunk(index, file_id, ms, loc, part_offset, limit)))
+                    next_part += 1
+
+                try:
+                    chunk = await pending.popleft()
+                except (FileReferenceExpired, FileReferenceInvalid):
+                    if msg_id is None or recoveries >= Config.STREAM_MAX_RECOVERIES: raise
+                    recoveries += 1
+                    stream_stats["reference_recoveries"] += 1
+                    self.cancel_pending(pending)
+                    meta = await get_file_meta(self.client, msg_id, refresh=True)
+                    file_id = meta.file_ids[self.client]
+                    loc = self.get_location(file_id)
+                    continue
+                except Exception as e:
+                    if self.scheduler: self.scheduler.record_error(index, e)
+                    raise
+
+                if not chunk: break
+                cut_start, cut_end = parts[curr][2:]
+                part = chunk[cut_start:cut_end]
+                streamed.inc(len(part))
+                sent = time.monotonic()
+                yield part
+                was_slow, slow = slow, time.monotonic() - sent > Config.STREAM_SLOW_CONSUMER
+                if slow and not was_slow: stream_stats["slow_consumer_pauses"] += 1
+                curr += 1
+        finally:
+            self.cancel_pending(pending)
+            self.work_loads[index] -= 1
+
+    def yield_range(self, file_id, index, start, end, msg_id=None):
+        """Streams the inclusive byte range [start, end], fetching no more of each 1 MB block than it needs."""
+        return self.yield_file(file_id, index, plan_parts(start, end), msg_id=msg_id)
@@ -1,19 +1,18 @@
 # webserver.py (FULL, COMPLETE CODE for the main.py structure)
 
-import math
 import traceback
 import os
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi.templating import Jinja2Templates
-from pyrogram.file_id import FileId
-from pyrogram import raw, Client
-from pyrogram.session import Session, Auth
 
 # Local imports from your project
 from config import Config
 from bot import multi_clients, work_loads, get_readable_file_size
 from database import db
+from streamer import ByteStreamer, get_file_meta
+from ranges import parse_range_header, RangeNotSatisfiable, MultipartByteranges, make_etag, etag_matches
+from responses import ClosingStreamingResponse
 
 # FastAPI app instance, started by main.py
 app = FastAPI()
@@ -41,60 +40,6 @@ def mask_filename(name: str) -> str:
     masked_base = ''.join(c if (i % 3 == 0 and c.isalnum()) else '*' for i, c in enumerate(base))
     return f"{masked_base}{res_part}{ext}"
 
-class ByteStreamer:
-    """Handles the low-level logic of fetching file parts from Telegram."""
-    def __init__(self, client: Client):
-        self.client = client
-
-    @staticmethod
-    async def get_location(file_id: FileId):
-        return raw.types.InputDocumentFileLocation(
-            id=file_id.media_id,
-            access_hash=file_id.access_hash,
-            file_reference=file_id.file_reference,
-            thumb_size=file_id.thumbnail_size
-        )
-
-    async def yield_file(self, file_id: FileId, index: int, offset: int, first_part_cut: int, last_part_cut: int, part_count: int, chunk_size: int):
-        client = self.client
-        work_loads[index] += 1
-        
-        media_session = client.media_sessions.get(file_id.dc_id)
-        if media_session is None:
-            if file_id.dc_id != await client.storage.dc_id():
-                auth_key = await Auth(client, file_id.dc_id, await client.storage.test_mode()).create()
-                media_session = Session(client, file_id.dc_id, auth_key, await client.storage.test_mode(), is_media=True)
-                await media_session.start()
-                exported_auth = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=file_id.dc_id))
-                await media_session.invoke(raw.functions.auth.ImportAuthorization(id=exported_auth.id, bytes=exported_auth.bytes))
-            else:
-                media_session = client.session
-            client.media_sessions[file_id.dc_id] = media_session
-        
-        location = await self.get_location(file_id)
-        current_part = 1
-        try:
-            while current_part <= part_count:
-                r = await media_session.invoke(
-                    raw.functions.upload.GetFile(location=location, offset=offset, limit=chunk_size),
-                    retries=0
-                )
-                if isinstance(r, raw.types.upload.File):
-                    chunk = r.bytes
-                    if not chunk: break
-                    
-                    if part_count == 1: yield chunk[first_part_cut:last_part_cut]
-                    elif current_part == 1: yield chunk[first_part_cut:]
-                    elif current_part == part_count: yield chunk[:last_part_cut]
-                    else: yield chunk
-                    
-                    current_part += 1
-                    offset += chunk_size
-                else:
-                    break
-        finally:
-            work_loads[index] -= 1
-
 @app.get("/show/{unique_id}", response_class=HTMLResponse)
 async def show_file_page(request: Request, unique_id: str):
     """The route that displays the download page to the user."""
@@ -108,9 +53,9 @@ async def show_file_page(request: Request, unique_id: str):
         if not main_bot:
             raise HTTPException(status_code=503, detail="Bot is not ready yet. Please try again in a moment.")
         
-        file_msg = await main_bot.get_messages(Config.STORAGE_CHANNEL, storage_msg_id)
-        media = file_msg.document or file_msg.video or file_msg.audio
-        if not media:
+        try:
+            media = await get_file_meta(main_bot, storage_msg_id)
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail="File not found in the message.")
         
         original_file_name = media.file_name or "file"
@@ -133,7 +78,7 @@ async def show_file_page(request: Request, unique_id: str):
         print(f"Error in /show route: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail="Internal server error.")
 
-@app.get("/dl/{msg_id}/{file_name}")
+@app.api_route("/dl/{msg_id}/{file_name}", methods=["GET", "HEAD"])
 async def stream_handler(request: Request, msg_id: int, file_name: str):
     """The route that handles the actual file streaming and download."""
     try:
@@ -145,48 +90,54 @@ async def stream_handler(request: Request, msg_id: int, file_name: str):
         
         tg_connect = class_cache.get(client)
         if not tg_connect:
-            tg_connect = ByteStreamer(client)
+            tg_connect = ByteStreamer(client, work_loads)
             class_cache[client] = tg_connect
             
-        message = await client.get_messages(Config.STORAGE_CHANNEL, msg_id)
-        media = message.document or message.video or message.audio
-        if not media or message.empty:
-            raise FileNotFoundError
-
-        file_id = FileId.decode(media.file_id)
+        media = await get_file_meta(client, msg_id)
+        file_id = media.file_ids[client]
         file_size = media.file_size
         
-        range_header = request.headers.get("Range", 0)
-        from_bytes, until_bytes = 0, file_size - 1
-        if range_header:
-            from_bytes_str, until_bytes_str = range_header.replace("bytes=", "").split("-")
-            from_bytes = int(from_bytes_str)
-            if until_bytes_str:
-                until_bytes = int(until_bytes_str)
-        
-        if (until_bytes >= file_size) or (from_bytes < 0):
-            raise HTTPException(status_code=416, detail="Requested range not satisfiable")
-        
-        req_length = until_bytes - from_bytes + 1
-        chunk_size = 1024 * 1024  # 1 MB
-        offset = (from_bytes // chunk_size) * chunk_size
-        first_part_cut = from_bytes - offset
-        last_part_cut = (until_bytes % chunk_size) + 1
-        part_count = math.ceil(req_length / chunk_size)
-        
-        body = tg_connect.yield_file(file_id, index, offset, first_part_cut, last_part_cut, part_count, chunk_size)
-        
-        status_code = 206 if range_header else 200
+        mime_type = media.mime_type or "application/octet-stream"
+        etag = make_etag(media.file_unique_id, file_size)
         headers = {
-            "Content-Type": media.mime_type or "application/octet-stream",
+            "Content-Type": mime_type,
             "Accept-Ranges": "bytes",
             "Content-Disposition": f'inline; filename="{media.file_name}"',
-            "Content-Length": str(req_length)
+            "ETag": etag,
+            "Cache-Control": Config.DL_CACHE_CONTROL,
         }
-        if range_header:
-            headers["Content-Range"] = f"bytes {from_bytes}-{until_bytes}/{file_size}"
-        
-        return StreamingResponse(content=body, status_code=status_code, headers=headers)
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": Config.DL_CACHE_CONTROL})
+
+        range_header = request.headers.get("Range")
+        # If-Range: only honour the range when the client's copy is still the current one
+        if_range = request.headers.get("If-Range")
+        if if_range and not etag_matches(if_range, etag, weak=False):
+            range_header = None
+        try:
+            ranges = parse_range_header(range_header, file_size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{file_size}", "Accept-Ranges": "bytes"})
+
+        if ranges is None or len(ranges) == 1:
+            from_bytes, until_bytes = ranges[0] if ranges else (0, file_size - 1)
+            headers["Content-Length"] = str(until_bytes - from_bytes + 1)
+            if ranges:
+                headers["Content-Range"] = f"bytes {from_bytes}-{until_bytes}/{file_size}"
+            status_code = 206 if ranges else 200
+            if request.method == "HEAD":
+                return Response(status_code=status_code, headers=headers)
+            body = tg_connect.yield_range(file_id, index, from_bytes, until_bytes, msg_id=msg_id)
+        else:
+            multipart = MultipartByteranges(ranges, file_size, mime_type)
+            headers["Content-Type"] = multipart.content_type
+            headers["Content-Length"] = str(multipart.content_length())
+            status_code = 206
+            if request.method == "HEAD":
+                return Response(status_code=status_code, headers=headers)
+            body = multipart.stream(lambda start, end: tg_connect.yield_range(file_id, index, start, end, msg_id=msg_id))
+
+        return ClosingStreamingResponse(content=body, status_code=status_code, headers=headers)
         
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found on Telegram.")
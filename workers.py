@@ -0,0 +1,83 @@
+# workers.py
+
+import asyncio
+import bisect
+import hashlib
+import time
+
+from config import Config
+from http_client import ControllerClient
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+class WorkerRegistry:
+    """
+    Tracks HF_STREAMING_URLS health and latency, and maps each msg_id to a worker
+    with a weighted consistent-hash ring. A file keeps landing on the same worker,
+    so each worker builds a stable hot set, and unhealthy workers are skipped.
+    """
+    VNODES = 100  # ring points for a worker at full weight
+
+    def __init__(self, urls):
+        self.urls = list(urls)
+        self.healthy = {url: True for url in self.urls}  # optimistic until the first probe
+        self.latency = {}
+        self._ring = []
+        self._owners = []
+        self._http = ControllerClient()
+        self.rebuild()
+
+    def weight(self, url) -> float:
+        """Share of ring points, from 0.25 to 1, scaled by latency relative to the fastest worker."""
+        known = [self.latency[u] for u in self.urls if self.healthy[u] and u in self.latency]
+        if url not in self.latency or not known: return 1.0
+        return max(0.25, min(1.0, min(known) / self.latency[url]))
+
+    def rebuild(self):
+        points = []
+        for url in self.urls:
+            if not self.healthy[url]: continue
+            for i in range(max(1, int(self.VNODES * self.weight(url)))):
+                points.append((_hash(f"{url}#{i}"), url))
+        points.sort()
+        self._ring = [p[0] for p in points]
+        self._owners = [p[1] for p in points]
+
+    def pick(self, msg_id):
+        """The worker that owns `msg_id`, or None if no worker is healthy."""
+        if not self._ring: return None
+        i = bisect.bisect(self._ring, _hash(str(msg_id))) % len(self._ring)
+        return self._owners[i]
+
+    async def probe(self, url):
+        started = time.monotonic()
+        try:
+            resp = await self._http.get(f"{url}/", retries=1, timeout=Config.WORKER_PROBE_TIMEOUT)
+            ok = resp.status_code < 500
+        except Exception:
+            ok = False
+        if ok:
+            took = time.monotonic() - started
+            # Smooth so one slow probe doesn't reshuffle the ring
+            self.latency[url] = took if url not in self.latency else 0.7 * self.latency[url] + 0.3 * took
+        return ok
+
+    async def run(self):
+        if not self.urls: return
+        while True:
+            results = await asyncio.gather(*[self.probe(url) for url in self.urls])
+            changed = False
+            for url, ok in zip(self.urls, results):
+                if self.healthy[url] != ok:
+                    print(f"{'✅' if ok else '⚠️'} Streaming worker {url} is {'back up' if ok else 'down'}")
+                    changed = True
+                self.healthy[url] = ok
+            self.rebuild()  # weights follow the latest latencies
+            if changed: print(f"🔁 Worker ring rebuilt: {sum(self.healthy.values())}/{len(self.urls)} healthy")
+            await asyncio.sleep(Config.WORKER_PROBE_INTERVAL)
+
+    def stats(self):
+        return {url: {"healthy": self.healthy[url], "latency_ms": int(self.latency.get(url, 0) * 1000), "weight": round(self.weight(url), 2)} for url in self.urls}
+
+worker_registry = WorkerRegistry(Config.HF_STREAMING_URLS)